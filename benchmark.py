@@ -0,0 +1,532 @@
+""" Times the stages of create_cogs.py on synthetic data, so the speed
+of the pipeline can be compared between versions. The proteomes and the
+BLAST results are generated with a fixed seed in a temporary directory,
+after which the following is timed:
+  1. write_direct_hits for all pairs of organisms
+  2. fill_database, add_constraints and analyze_tables
+  3. find_cogs, along with the time spent in update_cogs and new_cogs
+     (None with '--cog-jobs' above 1, as other processes find the cogs)
+  4. get_msa on a generated alignment
+  5. do_multiple_sequence_alignments (the MSA stage)
+  6. the lookups of cog_lookup.py (only with a real database)
+The database is a local PostgreSQL database when '--dsn <string>' is
+given, which is emptied with create_tables.sql, so it must not be a
+database with real data. With '--storage sqlite' or '--storage memory'
+the embedded database of create_cogs.py is used instead. Without
+either an in-memory stub of the database is used, which only measures
+the work done in Python.
+The results are written as JSON to standard output, or to the file
+given with '--output <file>'. Arguments of create_cogs.py, such as
+'--in-process-hits' or '--msa-threads', are used by the stages as well.
+"""
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import cog_lookup
+import create_cogs
+from create_cogs import get_argument, get_int_argument
+
+_AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+
+class StubCursor(object):
+    """ A cursor of 'StubDatabase'. Only the queries which are executed
+    by the timed stages are understood, every other query raises a
+    NotImplementedError so a change of the queries is noticed.
+    """
+
+    def __init__(self, connection):
+        """ Creates the cursor.
+
+        Parameters:
+            connection (StubDatabase): The database of the cursor.
+        """
+        self.connection = connection
+        self._rows = []
+
+    def execute(self, query, parameters=None):
+        query = " ".join(" ".join(line for line in query.splitlines()
+                                  if not line.startswith("--")).split())
+        database = self.connection
+        if query.startswith("INSERT INTO organism (name) VALUES"):
+            for statement in query.split(";"):
+                database.organisms.append(statement.split("'")[1])
+        elif query.startswith("INSERT INTO directionalhit") and \
+                "FROM temporaryhit" in query:
+            hits = set(database.tables.pop("temporaryhit", []))
+            database.twogs.extend(hit for hit in hits
+                                  if hit[0] < hit[1] and hit[::-1] in hits)
+        elif query.startswith(("DROP TABLE", "DELETE FROM cogassignment")):
+            for table in ("temporaryhit", "cogassignment"):
+                if table in query:
+                    database.tables.pop(table, None)
+        elif query.startswith(("CREATE TEMPORARY TABLE", "ALTER TABLE",
+                               "ANALYZE")):
+            pass
+        elif query.startswith("SELECT protein_a, protein_b, a.organism"):
+            self._rows = [(a, b, database.proteins[a][2],
+                           database.proteins[b][2])
+                          for a, b in database.twogs]
+        elif query.startswith("SELECT protein_id FROM protein WHERE cog"):
+            self._rows = [(protein,) for protein, row in
+                          database.proteins.items() if row[3] is not None]
+        elif query.startswith("SELECT cog, protein_id FROM protein"):
+            self._rows = sorted((row[3], protein) for protein, row in
+                                database.proteins.items()
+                                if row[3] is not None)
+        elif query.startswith("SELECT MAX(cog_id) FROM cog"):
+            self._rows = [(max(database.cogs, default=None),)]
+        elif query.startswith("UPDATE protein SET cog = cogassignment.cog"):
+            for protein, cog in database.tables.pop("cogassignment", []):
+                database.proteins[protein][3] = cog
+        elif query.startswith("UPDATE protein SET cog = NULL"):
+            for row in database.proteins.values():
+                row[3] = None
+        elif query.startswith("DELETE FROM cog"):
+            database.cogs.clear()
+        elif query.startswith("DELETE FROM multiplesequencealignment"):
+            database.alignments.clear()
+        elif query.startswith("SELECT name FROM organism"):
+            self._rows = [(name,) for name in database.organisms]
+        elif query.startswith("SELECT COUNT(*) FROM directionalhit"):
+            self._rows = [(len(database.twogs),)]
+        elif query.startswith("SELECT COUNT(*) FROM cog"):
+            self._rows = [(len(database.cogs),)]
+        elif query.startswith("SELECT protein.cog, protein.name"):
+            self._rows = database.cog_members("organism.name" in query)
+        else:
+            raise NotImplementedError(query)
+
+    def executemany(self, query, parameters):
+        if not query.startswith("INSERT INTO multiplesequencealignment"):
+            raise NotImplementedError(query)
+        self.connection.alignments.extend(parameters)
+
+    def copy_from(self, file, table, sep="\t", columns=None):
+        lines = []
+        data = file.read(8192)
+        while data:
+            lines.append(data)
+            data = file.read(8192)
+        rows = [line.split(sep) for line in "".join(lines).splitlines()]
+        if table == "protein":
+            for protein, name, sequence, organism in rows:
+                self.connection.proteins[int(protein)] = [
+                    name, sequence, int(organism), None]
+        elif table == "directionalhit":
+            self.connection.twogs.extend((int(a), int(b)) for a, b in rows)
+        elif table == "cog":
+            self.connection.cogs.update(int(cog) for cog, in rows)
+        else:
+            self.connection.tables.setdefault(table, []).extend(
+                (int(a), int(b)) for a, b in rows)
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        pass
+
+
+class StubDatabase(object):
+    """ Keeps the tables of the COG database in memory and acts as the
+    connection of the cursors which query them.
+    """
+
+    def __init__(self):
+        """ Creates an empty database. """
+        self.organisms = []
+        self.proteins = dict()
+        self.twogs = []
+        self.cogs = set()
+        self.alignments = []
+        self.tables = dict()
+
+    def cursor(self, name=None, withhold=False):
+        return StubCursor(self)
+
+    def cog_members(self, organism_names):
+        """ Gives the proteins of every cog in the order in which
+        'read_cog_members' reads them.
+
+        Parameters:
+            organism_names (boolean): Whether to give the name of the
+                organism instead of the sequence.
+        Returns:
+            1. List: tuples with the cog ID (0), the protein name (1)
+            and the organism name or sequence (2).
+        """
+        cogs = dict()
+        longest = dict()
+        for protein in sorted(self.proteins):
+            name, sequence, organism, cog = self.proteins[protein]
+            if cog is not None:
+                cogs.setdefault(cog, []).append((cog, name, self.organisms[
+                    organism - 1] if organism_names else sequence))
+                longest[cog] = max(longest.get(cog, 0), len(sequence))
+        cost = {cog: len(rows) * longest[cog] for cog, rows in cogs.items()}
+        return [row for cog in sorted(cogs, key=lambda cog: (-cost[cog], cog))
+                for row in cogs[cog]]
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def organism_names(amount):
+    """ Creates names of organisms of which none contains another.
+
+    Parameters:
+        amount (int): The amount of organisms.
+    Returns:
+        1. List of strings: The names.
+    """
+    return ["org{:0{}d}".format(index, len(str(amount)))
+            for index in range(amount)]
+
+
+def generate_data(organisms, proteins, hit_density, hits_per_protein, rng):
+    """ Writes a fasta file for every organism and a BLAST result file
+    ({org1}__{org2}, with the query and hit separated by ';') for every
+    pair of organisms in the current directory. Protein i of every
+    organism belongs to the same family: with a chance of hit_density
+    the best hit of a protein is the protein of its family in the other
+    organism, otherwise it is a random protein.
+
+    Parameters:
+        organisms (list of strings): The names of the organisms.
+        proteins (int): The amount of proteins per organism.
+        hit_density (float): The chance that the best hit of a protein
+            is in its family.
+        hits_per_protein (int): The amount of hits of every protein.
+        rng (random.Random): The source of randomness.
+    Returns:
+        1. Int: The amount of hits written.
+    """
+    for organism in organisms:
+        with open(organism + ".fa", "w") as outfile:
+            for index in range(proteins):
+                sequence = "".join(rng.choices(_AMINO_ACIDS,
+                                               k=rng.randint(50, 400)))
+                outfile.write(create_cogs.format_fasta([(
+                    "{}_p{} synthetic protein".format(organism, index),
+                    sequence)]))
+    hits = 0
+    for org1, org2 in create_cogs.organism_pairs(organisms):
+        with open("{}__{}".format(org1, org2), "w") as outfile:
+            for index in range(proteins):
+                best = (index if rng.random() < hit_density
+                        else rng.randrange(proteins))
+                for hit in [best] + [rng.randrange(proteins)
+                                     for _ in range(hits_per_protein - 1)]:
+                    outfile.write("{}_p{};{}_p{}\n".format(org1, index,
+                                                           org2, hit))
+                    hits += 1
+    return hits
+
+
+def clustal_lines(sequences, rng):
+    """ Creates an alignment in the ClustalW format of random
+    sequences, in blocks of 60 columns.
+
+    Parameters:
+        sequences (int): The amount of sequences.
+        rng (random.Random): The source of randomness.
+    Returns:
+        1. List of strings: The lines of the alignment.
+    """
+    length = rng.randint(200, 600)
+    rows = [("seq{}".format(index), "".join(
+        rng.choice(_AMINO_ACIDS + "-") for _ in range(length)))
+        for index in range(sequences)]
+    lines = ["CLUSTAL 2.1 multiple sequence alignment\n", "\n"]
+    for start in range(0, length, 60):
+        lines.append("\n")
+        for name, sequence in rows:
+            lines.append(name.ljust(16) + sequence[start:start + 60] + "\n")
+        lines.append(" " * 16 + "".join(
+            "*" if len(set(column)) == 1 else " " for column in zip(
+                *(sequence[start:start + 60] for _, sequence in rows))) +
+            "\n")
+    return lines
+
+
+class StageTimer(object):
+    """ Measures the wall clock and CPU time of stages. Functions of
+    create_cogs can be wrapped so the time spent in them is added up
+    over all calls.
+    """
+
+    def __init__(self):
+        """ Creates a timer without measurements. """
+        self.results = dict()
+
+    def add(self, stage, wall, cpu):
+        """ Adds time to a stage.
+
+        Parameters:
+            stage (string): The name of the stage.
+            wall (float): The wall clock time in seconds.
+            cpu (float): The CPU time in seconds.
+        Returns:
+            -
+        """
+        result = self.results.setdefault(stage, {"wall_seconds": 0.0,
+                                                 "cpu_seconds": 0.0,
+                                                 "calls": 0})
+        result["wall_seconds"] += wall
+        result["cpu_seconds"] += cpu
+        result["calls"] += 1
+
+    def skip(self, stage):
+        """ Adds a stage which could not be timed, with None as its
+        times and no calls, so the stage is still in the results.
+
+        Parameters:
+            stage (string): The name of the stage.
+        Returns:
+            -
+        """
+        self.results[stage] = {"wall_seconds": None, "cpu_seconds": None,
+                               "calls": 0}
+
+    def run(self, stage, function, *arguments):
+        """ Calls a function and adds its time to a stage.
+
+        Parameters:
+            stage (string): The name of the stage.
+            function (function): The function to call.
+            arguments: The arguments of the function.
+        Returns:
+            1. The return value of the function.
+        """
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            return function(*arguments)
+        finally:
+            self.add(stage, time.perf_counter() - wall,
+                     time.process_time() - cpu)
+
+    def wrap(self, name):
+        """ Replaces a function of create_cogs by one which adds its
+        time to the stage with the same name.
+
+        Parameters:
+            name (string): The name of the function.
+        Returns:
+            1. Function: The original function, to put back afterwards.
+        """
+        function = getattr(create_cogs, name)
+        setattr(create_cogs, name,
+                lambda *arguments: self.run(name, function, *arguments))
+        return function
+
+
+def time_lookups(connection, accessions, timer):
+    """ Times the lookups of 'cog_lookup.CogLookup' from accessions to
+    their cog, its members and its alignment. The lookups are done one
+    accession at a time without caches (lookups_single), for all
+    accessions at once (lookups_batched) and once more one at a time
+    with the caches which were filled by the batched lookups
+    (lookups_cached).
+
+    Parameters:
+        connection (psycopg2 connection class or EmbeddedConnection):
+            The connection with the database.
+        accessions (list of strings): The accessions to look up.
+        timer (StageTimer): The timer to add the times to.
+    Returns:
+        -
+    """
+    def single(lookup):
+        for accession in accessions:
+            cog = lookup.cog(accession)
+            if cog is not None:
+                lookup.cog_members(cog)
+                lookup.alignment(cog)
+
+    def batched(lookup):
+        cogs = set(lookup.cogs(accessions).values()) - {None}
+        lookup.members(cogs)
+        lookup.alignments(cogs)
+    uncached = cog_lookup.CogLookup(connection, 0, 0, 0)
+    timer.run("lookups_single", single, uncached)
+    uncached.close()
+    cached = cog_lookup.CogLookup(connection)
+    timer.run("lookups_batched", batched, cached)
+    timer.run("lookups_cached", single, cached)
+    cached.close()
+
+
+def run_benchmark(organisms, proteins, hit_density, hits_per_protein, seed,
+                  dsn=None, storage=None):
+    """ Generates the synthetic data in a temporary directory and times
+    every stage once.
+
+    Parameters:
+        organisms (int): The amount of organisms.
+        proteins (int): The amount of proteins per organism.
+        hit_density (float): The chance that the best hit of a protein
+            is in its family.
+        hits_per_protein (int): The amount of hits of every protein.
+        seed (int): The seed of the synthetic data.
+        dsn (string): The connection string of a PostgreSQL database,
+            or None to use the in-memory stub.
+        storage (string): 'sqlite' or 'memory' to use the embedded
+            database when no dsn is given, or None to use the stub.
+    Returns:
+        1. Dictionary: The timed stages, with per stage the wall clock
+        and CPU time in seconds and the amount of calls.
+        2. Dictionary: The amounts of generated and found items, along
+        with the counters of create_cogs.Metrics.
+    """
+    create_cogs._METRICS = create_cogs.Metrics()
+    rng = random.Random(seed)
+    names = organism_names(organisms)
+    timer = StageTimer()
+    directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_directory:
+        os.chdir(work_directory)
+        try:
+            hits = generate_data(names, proteins, hit_density,
+                                 hits_per_protein, rng)
+            for org1, org2 in create_cogs.organism_pairs(names):
+                timer.run("write_direct_hits", create_cogs.write_direct_hits,
+                          org1, org2)
+            if dsn is None and storage is None:
+                connection = StubDatabase()
+                cursor = connection.cursor()
+            else:
+                if dsn is not None:
+                    create_cogs._DATABASE_SETTINGS = {"dsn": dsn}
+                connection = create_cogs.connect_database(
+                    "postgres" if dsn is not None else storage)
+                cursor = connection.cursor()
+                with open(create_cogs.sql_file(connection,
+                                               "create_tables.sql")) as sql:
+                    cursor.execute(sql.read())
+                connection.commit()
+            timer.run("fill_database", create_cogs.fill_database,
+                      connection, cursor, names)
+            timer.run("add_constraints", create_cogs.add_constraints,
+                      connection, cursor)
+            timer.run("analyze_tables", create_cogs.analyze_tables,
+                      connection, cursor)
+            originals = [timer.wrap("update_cogs"), timer.wrap("new_cogs")]
+            try:
+                timer.run("find_cogs", create_cogs.find_cogs, connection,
+                          cursor, names)
+            finally:
+                create_cogs.update_cogs, create_cogs.new_cogs = originals
+            if get_int_argument("--cog-jobs", 1) > 1:
+                # The cogs are then found by extend_cogs and find_new_cogs
+                # in other processes, of which the time is not measured.
+                timer.skip("update_cogs")
+                timer.skip("new_cogs")
+            connection.commit()
+            with open("synthetic.aln", "w") as outfile:
+                outfile.writelines(clustal_lines(get_int_argument(
+                    "--msa-sequences", 50), rng))
+            timer.run("get_msa", create_cogs.get_msa, "synthetic.aln")
+            timer.run("msa_stage", create_cogs.do_multiple_sequence_alignments,
+                      cursor)
+            lookups = get_int_argument("--lookups", 10000)
+            if not isinstance(connection, StubDatabase):
+                time_lookups(connection, [
+                    "{}_p{}".format(rng.choice(names), rng.randrange(proteins))
+                    for _ in range(lookups)], timer)
+            counts = dict(create_cogs._METRICS.counters)
+            counts.update(proteins=organisms * proteins, blast_hits=hits)
+            for table, name in (("directionalhit", "twogs"), ("cog", "cogs")):
+                cursor.execute("SELECT COUNT(*) FROM " + table)
+                counts[name] = cursor.fetchone()[0]
+            cursor.close()
+            connection.close()
+        finally:
+            os.chdir(directory)
+    return timer.results, counts
+
+
+def git_commit():
+    """ Retrieves the commit of the code which is benchmarked.
+
+    Parameters:
+        -
+    Returns:
+        1. String: The hash of the commit, or None outside of git.
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    if "--aligner" not in sys.argv:
+        sys.argv += ["--aligner", "stub"]
+    settings = {
+        "organisms": get_int_argument("--organisms", 5),
+        "proteins": get_int_argument("--proteins", 1000),
+        "hit_density": float(get_argument("--hit-density", 0.8)),
+        "hits_per_protein": get_int_argument("--hits-per-protein", 3),
+        "seed": get_int_argument("--seed", 1),
+    }
+    dsn = get_argument("--dsn", None)
+    storage = get_argument("--storage", None)
+    if storage not in (None, "sqlite", "memory"):
+        raise Exception("Unknown storage '{}', choose from: sqlite, "
+                        "memory".format(storage))
+    if dsn is None and storage is None and \
+            get_int_argument("--load-jobs", 1) > 1:
+        raise Exception("--load-jobs needs a database, given with --dsn "
+                        "or --storage!")
+    runs = []
+    for _ in range(get_int_argument("--repeat", 1)):
+        stages, counts = run_benchmark(dsn=dsn, storage=storage, **settings)
+        runs.append(stages)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "database": "postgresql" if dsn else storage or "stub",
+        "arguments": sys.argv[1:],
+        "settings": settings,
+        "counts": counts,
+        "stages": {stage: None if runs[0][stage]["wall_seconds"] is None
+                   else min(run[stage]["wall_seconds"] for run in runs)
+                   for stage in runs[0]},
+        "lookups_per_second": {
+            stage: get_int_argument("--lookups", 10000) / max(
+                min(run[stage]["wall_seconds"] for run in runs), 1e-9)
+            for stage in runs[0] if stage.startswith("lookups_")},
+        "runs": runs,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    output = get_argument("--output", None)
+    if output is None:
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
+        print()
+    else:
+        with open(output, "w") as outfile:
+            json.dump(report, outfile, indent=1, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+""" Looks up the results of create_cogs.py in its database: the cog of
+a protein accession, the proteins in a cog and the multiple sequence
+alignment of a cog. Every lookup takes many keys at once, which are
+sent to the database in batches of _BATCH_SIZE keys with a single
+query per batch. The queries are prepared once per connection (on an
+embedded database the sqlite3 module already keeps them prepared). The
+cogs of accessions and the members and alignments of cogs are kept in
+caches of a bounded size which forget the least recently used keys
+first, so repeated lookups of the same keys do not reach the database
+at all. On PostgreSQL the
+transaction of a lookup is ended after every batch, unless the
+connection was already in a transaction, so a long running service
+does not hold locks which block a new run of create_cogs.py.
+
+The lookups use the indexes on the accessions of the proteins (the
+first word of their name), on protein(cog) and on
+multiplesequencealignment(cog), which are made by
+create_constraints.sql.
+"""
+from collections import OrderedDict
+
+from create_cogs import decode_msa, is_embedded
+
+import itertools
+import psycopg2.extensions
+import threading
+
+_BATCH_SIZE = 1000
+_COG_CACHE_SIZE = 1000000
+_MEMBER_CACHE_SIZE = 1000000
+_ALIGNMENT_CACHE_SIZE = 256 * 1024 * 1024
+_STATEMENT_NUMBERS = itertools.count()
+_QUERIES = {
+    "cogs": """
+        SELECT split_part(name, ' ', 1), cog
+        FROM protein
+        WHERE split_part(name, ' ', 1) = ANY(%s)""",
+    "members": """
+        SELECT cog, name
+        FROM protein
+        WHERE cog = ANY(%s)
+        ORDER BY cog ASC, protein_id ASC""",
+    "alignments": """
+        SELECT cog, msa, msa_zlib
+        FROM multiplesequencealignment
+        WHERE cog = ANY(%s)
+        ORDER BY msa_id ASC""",
+}
+
+
+class LRUCache(object):
+    """ A cache which keeps values until their total size is larger
+    than the maximum size, after which the values which were used the
+    longest ago are removed. The size of a value is given by a
+    function, for instance the length of a list.
+    """
+
+    def __init__(self, max_size, size=lambda value: 1):
+        """ Creates an empty cache.
+
+        Parameters:
+            max_size (int): The maximum total size of the values. With
+                0 nothing is kept.
+            size (function): Gives the size of a value.
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._size = size
+        self._values = OrderedDict()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, keys):
+        """ Retrieves the values of keys which are in the cache, which
+        become the most recently used.
+
+        Parameters:
+            keys (iterable): The keys.
+        Returns:
+            1. Dictionary: The keys which are in the cache with their
+            values.
+            2. List: The keys which are not in the cache.
+        """
+        found = dict()
+        missing = []
+        for key in keys:
+            if key in self._values:
+                self._values.move_to_end(key)
+                found[key] = self._values[key][0]
+            else:
+                missing.append(key)
+        self.hits += len(found)
+        self.misses += len(missing)
+        return found, missing
+
+    def put(self, key, value):
+        """ Adds a value and removes the least recently used values
+        when the cache is full. A value which is larger than the cache
+        is not kept.
+
+        Parameters:
+            key (object): The key.
+            value (object): The value.
+        Returns:
+            -
+        """
+        if key in self._values:
+            self.size -= self._values.pop(key)[1]
+        size = self._size(value)
+        if size > self.max_size:
+            return
+        self._values[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            self.size -= self._values.popitem(last=False)[1][1]
+
+    def clear(self):
+        """ Removes all values.
+
+        Parameters:
+            -
+        Returns:
+            -
+        """
+        self._values.clear()
+        self.size = 0
+
+
+class CogLookup(object):
+    """ Looks up cogs, their members and their alignments in the
+    database of create_cogs.py. The lookups of one object may be used
+    from several threads, as long as the connection allows that.
+    """
+
+    def __init__(self, connection, member_cache_size=_MEMBER_CACHE_SIZE,
+                 alignment_cache_size=_ALIGNMENT_CACHE_SIZE,
+                 cog_cache_size=_COG_CACHE_SIZE):
+        """ Creates the lookups and prepares their queries.
+
+        Parameters:
+            connection (psycopg2 connection class or EmbeddedConnection):
+                The connection with the database.
+            member_cache_size (int): The maximum amount of proteins in
+                the cached members of cogs.
+            alignment_cache_size (int): The maximum amount of
+                characters in the cached alignments.
+            cog_cache_size (int): The maximum amount of accessions of
+                which the cog is cached.
+        """
+        self.connection = connection
+        self.cogs_cache = LRUCache(cog_cache_size)
+        self.members_cache = LRUCache(
+            member_cache_size, lambda members: max(1, len(members)))
+        self.alignments_cache = LRUCache(
+            alignment_cache_size, lambda msa: max(1, len(msa or "")))
+        self._cursor = connection.cursor()
+        self._lock = threading.Lock()
+        self._statements = dict()
+        number = next(_STATEMENT_NUMBERS)
+        idle = self._idle()
+        for name, query in _QUERIES.items():
+            if is_embedded(connection):
+                self._statements[name] = query
+                continue
+            statement = "cog_lookup_{}_{}".format(name, number)
+            self._cursor.execute("PREPARE {} AS {}".format(
+                statement, query.replace("%s", "$1")))
+            self._statements[name] = "EXECUTE {} (%s)".format(statement)
+        if idle:
+            connection.commit()
+
+    def _idle(self):
+        """ Checks whether the connection is with PostgreSQL and not in
+        a transaction, so a transaction which is started by a lookup
+        can be ended afterwards. Prepared queries are kept when a
+        transaction ends.
+
+        Parameters:
+            -
+        Returns:
+            1. Boolean: Whether the transaction should be ended.
+        """
+        return (not is_embedded(self.connection) and
+                self.connection.get_transaction_status() ==
+                psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+    def _query(self, name, keys):
+        """ Executes one of the _QUERIES for keys, in batches of
+        _BATCH_SIZE keys. The transaction is ended after every batch
+        when the connection was not in a transaction before.
+
+        Parameters:
+            name (string): The name of the query.
+            keys (list): The keys.
+        Returns:
+            1. Generator: yields the rows of all batches.
+        """
+        for start in range(0, len(keys), _BATCH_SIZE):
+            idle = self._idle()
+            self._cursor.execute(self._statements[name],
+                                 (keys[start:start + _BATCH_SIZE],))
+            rows = self._cursor.fetchall()
+            if idle:
+                self.connection.commit()
+            yield from rows
+
+    def cogs(self, accessions):
+        """ Looks up the cogs of proteins. Accessions which are not in
+        the database are not cached, so they are looked up again.
+
+        Parameters:
+            accessions (iterable of strings): The accessions of the
+                proteins, the first word of their name.
+        Returns:
+            1. Dictionary: The accessions which are in the database as
+            keys and their cog, or None when they are in no cog, as
+            values.
+        """
+        with self._lock:
+            found, missing = self.cogs_cache.get(set(accessions))
+            for accession, cog in self._query("cogs", missing):
+                found[accession] = cog
+                self.cogs_cache.put(accession, cog)
+            return found
+
+    def members(self, cogs):
+        """ Looks up the proteins in cogs.
+
+        Parameters:
+            cogs (iterable of ints): The cog ID's.
+        Returns:
+            1. Dictionary: The cogs as keys and a list of the names of
+            their proteins, in ascending order of their ID's, as
+            values. Cogs which do not exist get an empty list.
+        """
+        with self._lock:
+            found, missing = self.members_cache.get(set(cogs))
+            for cog in missing:
+                found[cog] = []
+            for cog, rows in itertools.groupby(
+                    self._query("members", missing), key=lambda row: row[0]):
+                found[cog] = [name for _, name in rows]
+            for cog in missing:
+                self.members_cache.put(cog, found[cog])
+            return found
+
+    def alignments(self, cogs):
+        """ Looks up the multiple sequence alignments of cogs, whether
+        they are stored as text or compressed.
+
+        Parameters:
+            cogs (iterable of ints): The cog ID's.
+        Returns:
+            1. Dictionary: The cogs as keys and their complete multiple
+            sequence alignment, or None when they have none, as values.
+        """
+        with self._lock:
+            found, missing = self.alignments_cache.get(set(cogs))
+            for cog in missing:
+                found[cog] = None
+            for cog, msa, msa_zlib in self._query("alignments", missing):
+                found[cog] = decode_msa(msa, msa_zlib)
+            for cog in missing:
+                self.alignments_cache.put(cog, found[cog])
+            return found
+
+    def cog(self, accession):
+        """ Looks up the cog of a single protein, see 'cogs'.
+
+        Parameters:
+            accession (string): The accession of the protein.
+        Returns:
+            1. Int: The cog, or None when the protein is in no cog or
+            not in the database.
+        """
+        return self.cogs([accession]).get(accession)
+
+    def cog_members(self, cog):
+        """ Looks up the proteins in a single cog, see 'members'.
+
+        Parameters:
+            cog (int): The cog ID.
+        Returns:
+            1. List of strings: The names of the proteins.
+        """
+        return self.members([cog])[cog]
+
+    def alignment(self, cog):
+        """ Looks up the alignment of a single cog, see 'alignments'.
+
+        Parameters:
+            cog (int): The cog ID.
+        Returns:
+            1. String: The alignment, or None when it has none.
+        """
+        return self.alignments([cog])[cog]
+
+    def clear(self):
+        """ Empties the caches, which is needed when the database was
+        changed, for instance by a run of create_cogs.py.
+
+        Parameters:
+            -
+        Returns:
+            -
+        """
+        with self._lock:
+            self.cogs_cache.clear()
+            self.members_cache.clear()
+            self.alignments_cache.clear()
+
+    def close(self):
+        """ Removes the prepared queries and closes the cursor.
+
+        Parameters:
+            -
+        Returns:
+            -
+        """
+        with self._lock:
+            idle = self._idle()
+            if not is_embedded(self.connection):
+                for statement in self._statements.values():
+                    self._cursor.execute("DEALLOCATE " + statement.split()[1])
+            if idle:
+                self.connection.commit()
+            self._cursor.close()
@@ -1,431 +1,2978 @@
+from array import array
 from collections import Counter, OrderedDict
+from multiprocessing import Pipe, Pool, Process
 from multiprocessing.pool import ThreadPool
 
+from contextlib import contextmanager
+from embedded_database import EmbeddedConnection, EmbeddedCursor
+from fasta_index import FastaIndex
+
+import bisect
+import cProfile
+import hashlib
+import itertools
+import json
+import pstats
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+import queue
+import resource
+import subprocess
 import sys
+import tempfile
+import threading
+import time
 import os
+import zlib
+
+
+_BLAST_COMMAND = ("blastp -outfmt 6 -query {org1}.fa -db {org2}.fa " +
+                  "-evalue 1e-10 -num_threads {n_threads}")
+_MAKEBLASTDB_COMMAND = "makeblastdb -in {organism}.fa -dbtype prot"
+_EVALUE = 1e-10
+_COMBINED_PROTEOME = "combined_proteomes"
+_COMBINED_TARGETS_PER_ORGANISM = 50
+_MANIFEST_FILE = "manifest.json"
+_STAGES = ("blast", "load", "cogs", "msa")
+_MSA_BATCH_SIZE = 100
+_PROFILE_FUNCTIONS = 50
+_DATABASE_SETTINGS = {"host": "localhost", "dbname": "postgres",
+                      "user": "postgres", "password": "Password"}
+_STORAGES = ("postgres", "sqlite", "memory")
+_SQLITE_FILE = "cogs.sqlite"
+_EXPORT_TABLES = (
+    ("organism", ("organism_id", "name")),
+    ("cog", ("cog_id",)),
+    ("protein", ("protein_id", "name", "sequence", "organism", "cog")),
+    ("directionalhit", ("hit_id", "protein_a", "protein_b")),
+    ("multiplesequencealignment", ("msa_id", "msa", "msa_zlib", "cog")))
+_WORKER_PROTEIN_IDS = None
+_PROCESSES = set()
+_PROCESSES_LOCK = threading.Lock()
+_STOPPING_PROCESSES = threading.Event()
+
+
+def get_int_argument(argument, default):
+    """ Retrieves the positive integer which is given after an argument
+    on the command line, for instance '--msa-threads 4'. When the
+    argument is not given or is not followed by a number, the default
+    is returned.
+
+    Parameters:
+        argument (string): The argument, including the dashes.
+        default (int): The value to use when the argument is missing.
+    Returns:
+        1. Int: The value of the argument, at least 1.
+    """
+    if argument in sys.argv:
+        index = sys.argv.index(argument)
+        if (index + 1 < len(sys.argv) and
+                sys.argv[index + 1].strip().isnumeric()):
+            return max(1, int(sys.argv[index + 1].strip()))
+    return default
+
+
+def get_argument(argument, default):
+    """ Retrieves the value which is given after an argument on the
+    command line, for instance '--aligner mafft'.
+
+    Parameters:
+        argument (string): The argument, including the dashes.
+        default (string): The value to use when the argument is missing.
+    Returns:
+        1. String: The value of the argument.
+    """
+    if argument in sys.argv:
+        index = sys.argv.index(argument)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1].strip()
+    return default
+
+
+def handle_blast_arguments():
+    """ Handles the arguments given on the command line
+    related to the BLAST settings. The different arguments are:
+    --no-blast: marks the algorithm to not execute the BLAST commands
+    --blast-threads <int>: the amount of threads which
+    each BLAST command should be executed with.
+    --blast-cores <int>: the total amount of cores which may be used
+    by BLAST commands running at the same time. Defaults to the amount
+    of cores of this machine.
+    --no-blast-dbs: marks the algorithm to not execute the makeblastdb
+    commands.
+
+    Parameters:
+        -
+    Returns:
+        1. Boolean: execute BLAST commands
+        2. Boolean: execute makeblastdb commands
+        3. Int: amount of BLAST threads per BLAST command
+        4. Int: amount of BLAST commands which run at the same time
+    """
+    if "--no-blast" in sys.argv:
+        return False, False, -1, 1
+    threads = get_int_argument("--blast-threads", 3)
+    cores = get_int_argument("--blast-cores", os.cpu_count() or 1)
+    jobs = max(1, cores // threads)
+    return True, "--no-blast-dbs" not in sys.argv, min(threads, cores), jobs
+
+
+def file_hash(file):
+    """ Calculates the SHA-256 hash of the contents of a file.
+
+    Parameters:
+        file (string): The name of the file.
+    Returns:
+        1. String: The hexadecimal hash.
+    """
+    digest = hashlib.sha256()
+    with open(file, "rb") as infile:
+        for block in iter(lambda: infile.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest(object):
+    """ Remembers which results were made from which inputs, so work of
+    an earlier (possibly crashed) run does not have to be done again.
+    Inputs are identified by the hash of their contents: a proteome by
+    the hash of its fasta file and a pair of organisms by the hashes of
+    both proteomes along with the BLAST command. Next to that the
+    completed stages of the pipeline are remembered along with a key
+    of all inputs of the run. The manifest is saved to disk after every
+    change. When disabled, nothing is remembered from earlier runs.
+    """
+
+    def __init__(self, file_name=_MANIFEST_FILE, enabled=True):
+        """ Creates the manifest and reads it from disk when it exists.
+
+        Parameters:
+            file_name (string): The name of the manifest file.
+            enabled (boolean): Whether the manifest of earlier runs may
+                be used.
+        """
+        self._file_name = file_name
+        self._data = {"proteomes": {}, "databases": {}, "pairs": {},
+                      "stages": {}, "started": {}}
+        if enabled and os.path.exists(file_name):
+            with open(file_name) as infile:
+                self._data.update(json.load(infile))
+
+    def save(self):
+        """ Writes the manifest to disk.
+
+        Parameters:
+            -
+        Returns:
+            -
+        """
+        write_result_file(self._file_name, [json.dumps(
+            self._data, indent=1, sort_keys=True)])
+
+    def proteome_hash(self, organism):
+        """ Retrieves the hash of the fasta file of an organism. The
+        hash is only calculated again when the size or modification
+        time of the file changed.
+
+        Parameters:
+            organism (string): The name of the organism.
+        Returns:
+            1. String: The hexadecimal hash.
+        """
+        stat = os.stat(organism + ".fa")
+        known = self._data["proteomes"].get(organism)
+        if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        proteome_hash = file_hash(organism + ".fa")
+        self._data["proteomes"][organism] = [stat.st_size, stat.st_mtime_ns,
+                                             proteome_hash]
+        return proteome_hash
+
+    def input_key(self, organisms, *settings):
+        """ Creates a key which changes whenever one of the given
+        organisms, their proteomes or the settings change.
+
+        Parameters:
+            organisms (list of strings): The organisms.
+            *settings: Other values which influence the result. These
+                must be serializable as JSON.
+        Returns:
+            1. String: The key.
+        """
+        return hashlib.sha256(json.dumps(
+            [[organism, self.proteome_hash(organism)]
+             for organism in organisms] + list(settings)).encode()
+        ).hexdigest()
+
+    def has_database(self, organism, search):
+        """ Checks whether the database of an organism for a homology
+        search is made from its current proteome.
+
+        Parameters:
+            organism (string): The name of the organism.
+            search (CommandSearch): The homology search.
+        Returns:
+            1. Boolean: Whether the database is up to date.
+        """
+        return (self._data["databases"].get(search.name + ":" + organism) ==
+                self.proteome_hash(organism) and
+                search.database_exists(organism))
+
+    def add_database(self, organism, search):
+        """ Remembers that the database of an organism for a homology
+        search is made from its current proteome.
+
+        Parameters:
+            organism (string): The name of the organism.
+            search (CommandSearch): The homology search.
+        Returns:
+            -
+        """
+        self._data["databases"][search.name + ":" + organism] = (
+            self.proteome_hash(organism))
+        self.save()
+
+    def has_result(self, result_file, key):
+        """ Checks whether a result file exists and was made from the
+        inputs identified by the key.
+
+        Parameters:
+            result_file (string): The name of the result file.
+            key (string): The key as given by 'input_key'.
+        Returns:
+            1. Boolean: Whether the result is up to date.
+        """
+        return (self._data["pairs"].get(result_file) == key and
+                os.path.exists(result_file))
+
+    def add_result(self, result_file, key):
+        """ Remembers that a result file was made from the inputs
+        identified by the key.
+
+        Parameters:
+            result_file (string): The name of the result file.
+            key (string): The key as given by 'input_key'.
+        Returns:
+            -
+        """
+        self._data["pairs"][result_file] = key
+        self.save()
+
+    def stage_done(self, stage, key):
+        """ Checks whether a stage of the pipeline was completed with
+        the inputs identified by the key.
+
+        Parameters:
+            stage (string): One of the stages in _STAGES.
+            key (string): The key as given by 'input_key'.
+        Returns:
+            1. Boolean: Whether the stage can be skipped.
+        """
+        return self._data["stages"].get(stage) == key
+
+    def complete_stage(self, stage, key):
+        """ Remembers that a stage of the pipeline is completed. All
+        later stages are forgotten, as those depend on this stage.
+
+        Parameters:
+            stage (string): One of the stages in _STAGES.
+            key (string): The key as given by 'input_key'.
+        Returns:
+            -
+        """
+        self.forget_stages(stage)
+        self._data["stages"][stage] = key
+        self.save()
+
+    def start_stage(self, stage, key):
+        """ Remembers with which inputs the results of a stage are
+        made, for a stage which keeps the results of a run which did
+        not complete.
+
+        Parameters:
+            stage (string): One of the stages in _STAGES.
+            key (string): The key of the inputs which change the
+                results, as given by 'input_key'.
+        Returns:
+            1. Boolean: Whether the results of earlier runs were made
+            with the same inputs, so they can be kept.
+        """
+        same = self._data["started"].get(stage) == key
+        self._data["started"][stage] = key
+        self.save()
+        return same
+
+    def forget_stages(self, stage):
+        """ Forgets that a stage of the pipeline and all later stages
+        were completed.
+
+        Parameters:
+            stage (string): One of the stages in _STAGES.
+        Returns:
+            -
+        """
+        for later_stage in _STAGES[_STAGES.index(stage):]:
+            self._data["stages"].pop(later_stage, None)
+
+
+class Metrics(object):
+    """ Measures the wall clock time, CPU time and peak memory use of
+    the stages of the pipeline and of every organism within a stage,
+    and counts the work which is done: proteins loaded, twogs
+    processed, cogs created or extended, alignments made and SQL round
+    trips. With profiling enabled, every outermost stage is run under
+    cProfile. Only the thread which runs the stage is profiled, so the
+    work of BLAST and the aligners shows up as waiting.
+    The operating system only gives the peak memory use of the whole
+    process so far, so a stage gets both that peak and how much the
+    peak grew during the stage. A stage which used less memory than an
+    earlier stage therefore grows the peak by 0.
+    """
+
+    def __init__(self):
+        """ Creates empty metrics. """
+        self.stages = []
+        self.counters = Counter()
+        self.profiles = dict()
+        self.profile = False
+        self._depth = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, item=None):
+        """ Measures the code which runs within the with statement.
+
+        Parameters:
+            name (string): The name of the stage.
+            item (string): What the stage is working on, for instance an
+                organism, or None for the whole stage.
+        Returns:
+            1. Context manager: measures the stage when it exits.
+        """
+        profiler = None
+        if self.profile and self._depth == 0:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        self._depth += 1
+        wall, cpu = time.perf_counter(), time.process_time()
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            self._depth -= 1
+            if profiler is not None:
+                profiler.disable()
+                self.profiles[name] = profile_rows(profiler)
+            process_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.stages.append({
+                "stage": name, "item": item, "depth": self._depth,
+                "wall_seconds": wall, "cpu_seconds": cpu,
+                "process_peak_rss_kb": process_peak,
+                "peak_rss_increase_kb": process_peak - peak,
+                "children_peak_rss_kb": resource.getrusage(
+                    resource.RUSAGE_CHILDREN).ru_maxrss})
+
+    def count(self, name, amount=1):
+        """ Adds to a counter. Can be called from any thread.
+
+        Parameters:
+            name (string): The name of the counter.
+            amount (int): The amount to add.
+        Returns:
+            -
+        """
+        with self._lock:
+            self.counters[name] += amount
+
+    def report(self):
+        """ Gives all measurements.
+
+        Parameters:
+            -
+        Returns:
+            1. Dictionary: The measured stages (in the order they
+            finished), the counters and, when profiling, the most
+            expensive functions per stage.
+        """
+        report = {"stages": self.stages, "counters": dict(self.counters)}
+        if self.profile:
+            report["profiles"] = self.profiles
+        return report
+
+    def summary(self):
+        """ Describes the outermost stages and the counters.
+
+        Parameters:
+            -
+        Returns:
+            1. List of strings: The lines of the summary.
+        """
+        lines = [("{}: {:.1f} s wall, {:.1f} s CPU, {:.0f} MB process peak "
+                  "(+{:.0f} MB)").format(
+            stage["stage"], stage["wall_seconds"], stage["cpu_seconds"],
+            stage["process_peak_rss_kb"] / 1024,
+            stage["peak_rss_increase_kb"] / 1024) for stage in self.stages
+            if stage["depth"] == 0]
+        lines.extend("{}: {}".format(name, amount)
+                     for name, amount in sorted(self.counters.items()))
+        return lines
+
+
+def profile_rows(profiler):
+    """ Collects the functions which took the most time, including the
+    functions they called, from a profiler.
+
+    Parameters:
+        profiler (cProfile.Profile): The profiler.
+    Returns:
+        1. List of dictionaries: The _PROFILE_FUNCTIONS most expensive
+        functions with their amount of calls and their own and
+        cumulative time in seconds.
+    """
+    rows = [{"function": "{}:{}({})".format(*function), "calls": calls,
+             "primitive_calls": primitive_calls, "total_seconds": total,
+             "cumulative_seconds": cumulative}
+            for function, (primitive_calls, calls, total, cumulative, _)
+            in pstats.Stats(profiler).stats.items()]
+    rows.sort(key=lambda row: row["cumulative_seconds"], reverse=True)
+    return rows[:_PROFILE_FUNCTIONS]
+
+
+class RoundTripCounter(object):
+    """ Counts the round trips of a cursor to the database in _METRICS.
+    Every row of executemany is sent on its own. This is mixed into
+    the cursor classes of both kinds of database.
+    """
+
+    def execute(self, query, vars=None):
+        _METRICS.count("sql_round_trips")
+        return super(RoundTripCounter, self).execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        _METRICS.count("sql_round_trips", len(vars_list))
+        return super(RoundTripCounter, self).executemany(query, vars_list)
+
+    def copy_from(self, *args, **kwargs):
+        _METRICS.count("sql_round_trips")
+        return super(RoundTripCounter, self).copy_from(*args, **kwargs)
+
+
+class CountingCursor(RoundTripCounter, psycopg2.extensions.cursor):
+    """ A psycopg2 cursor which counts its round trips. """
+
+
+class CountingEmbeddedCursor(RoundTripCounter, EmbeddedCursor):
+    """ A cursor of the embedded database which counts its round trips,
+    which are statements that do not leave the process.
+    """
+
+
+_METRICS = Metrics()
+
+
+def check_command(command, process):
+    """ Checks whether a finished command exited successfully.
+
+    Parameters:
+        command (list of strings): The command which was executed.
+        process (subprocess Popen or CompletedProcess class): The
+            finished process of the command.
+    Returns:
+        -
+    """
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+@contextmanager
+def managed_process(command, **arguments):
+    """ Starts a command with subprocess.Popen and remembers the process
+    while it runs, so 'stop_processes' can kill it. When the block is
+    left before the process finished, for instance on an error, the
+    process is killed.
+
+    Parameters:
+        command (list of strings): The command to execute.
+        **arguments: The arguments of subprocess.Popen.
+    Returns:
+        1. Context manager: gives the subprocess Popen class.
+    """
+    with _PROCESSES_LOCK:
+        if _STOPPING_PROCESSES.is_set():
+            raise Exception("Not starting {}, the commands are being "
+                            "stopped!".format(command[0]))
+        process = subprocess.Popen(command, **arguments)
+        _PROCESSES.add(process)
+    try:
+        yield process
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        with _PROCESSES_LOCK:
+            _PROCESSES.discard(process)
+
+
+def run_command(command, input=None, timeout=None, **arguments):
+    """ Runs a command until it finishes, like subprocess.run, using
+    'managed_process'. A command which takes longer than the timeout is
+    killed.
+
+    Parameters:
+        command (list of strings): The command to execute.
+        input (string): Is written to the standard input of the
+            command, or None to give it no input.
+        timeout (int): The amount of seconds the command may take, or
+            None to wait until it finishes.
+        **arguments: Other arguments of subprocess.Popen.
+    Returns:
+        1. subprocess CompletedProcess class: The finished process.
+    """
+    if input is not None:
+        arguments["stdin"] = subprocess.PIPE
+    with managed_process(command, **arguments) as process:
+        stdout, stderr = process.communicate(input, timeout)
+    return subprocess.CompletedProcess(command, process.returncode, stdout,
+                                       stderr)
+
+
+def stop_processes(pool):
+    """ Stops a pool of threads which run commands, after an error or
+    Ctrl-C: the commands started by 'managed_process' are killed and no
+    new command is started until every thread of the pool is finished.
+    Without this the commands keep running after the script stopped.
+
+    Parameters:
+        pool (multiprocessing.pool.ThreadPool class): The pool.
+    Returns:
+        -
+    """
+    with _PROCESSES_LOCK:
+        _STOPPING_PROCESSES.set()
+        for process in _PROCESSES:
+            if process.poll() is None:
+                process.kill()
+    try:
+        pool.terminate()
+    finally:
+        _STOPPING_PROCESSES.clear()
+
+
+class CommandSearch(object):
+    """ Searches homologous proteins with a program which writes its
+    hits in a tabular format on its standard output, with the query
+    and the hit as first two columns. All hits of a query must be
+    written after each other, the best hit first.
+    """
 
+    def __init__(self, name, search_command, database_command,
+                 database_extensions, combined_command=None):
+        """ Creates the search.
+
+        Parameters:
+            name (string): The name of the search.
+            search_command (string): The command to search with, where
+                '{org1}', '{org2}' and '{n_threads}' are replaced by
+                the query organism, the database organism and the
+                amount of threads.
+            database_command (string): The command to create a
+                database with, where '{organism}' is replaced by the
+                organism.
+            database_extensions (list of strings): Extensions of which
+                one is added to '{organism}.fa' when the database of
+                the organism exists.
+            combined_command (string): The command to search against
+                the database of all organisms with, which writes the
+                e-value in the 11th column. '{org1}', '{database}',
+                '{n_threads}', '{evalue}' and '{max_targets}' are
+                replaced. None when the search does not support this.
+        """
+        self.name = name
+        self.search_command = search_command
+        self.database_command = database_command
+        self.database_extensions = database_extensions
+        self.combined_command = combined_command
+
+    @property
+    def key(self):
+        """ Identifies the settings of the search, used by the Manifest
+        to know whether hits have to be searched again.
+        """
+        return [self.name, self.search_command, self.database_command,
+                self.combined_command]
+
+    def database_exists(self, organism):
+        """ Checks whether the database of an organism exists.
+
+        Parameters:
+            organism (string): The name of the organism.
+        Returns:
+            1. Boolean: Whether the database exists.
+        """
+        return any(os.path.exists(organism + ".fa" + extension)
+                   for extension in self.database_extensions)
+
+    def make_database(self, organism):
+        """ Creates the database from the fasta file of an organism.
+
+        Parameters:
+            organism (string): The name of the organism.
+        Returns:
+            -
+        """
+        command = self.database_command.format(organism=organism).split()
+        check_command(command, run_command(command,
+                                           stdout=subprocess.DEVNULL))
+
+    def run(self, command):
+        """ Runs a search command and yields the columns of every line
+        directly from the output of the program. When the output is
+        consumed, the exit code of the program is checked.
+
+        Parameters:
+            command (list of strings): The command to run.
+        Returns:
+            1. Generator: yields lists of columns.
+        """
+        with managed_process(command, stdout=subprocess.PIPE,
+                             universal_newlines=True) as process:
+            with process.stdout:
+                for line in process.stdout:
+                    yield line.split()
+            process.wait()
+        check_command(command, process)
+
+    def search(self, org1, org2, threads):
+        """ Searches the proteome of organism 1 against the database of
+        organism 2 and yields the accessions of the query and the hit
+        of every result as soon as the program writes them.
+
+        Parameters:
+            org1 (string): The name of the first organism
+            org2 (string): The name of the second organism
+            threads (int): The amount of threads the program should use.
+        Returns:
+            1. Generator: yields tuples with the accession of the query
+            (0) and the accession of the hit (1).
+        """
+        for columns in self.run(self.search_command.format(
+                org1=org1, org2=org2, n_threads=threads).split()):
+            yield columns[0], columns[1]
+
+    def search_combined(self, org1, organisms, threads, evalue, max_targets):
+        """ Searches the proteome of organism 1 against the database of
+        all organisms, as made by 'make_combined_proteome'.
+
+        Parameters:
+            org1 (string): The name of the query organism.
+            organisms (list of strings): The organisms in the database.
+            threads (int): The amount of threads the program should use.
+            evalue (float): The highest e-value to report.
+            max_targets (int): The maximum amount of hits per query.
+        Returns:
+            1. Generator: yields tuples with the accession of the query
+            (0), the tagged accession of the hit (1) and the e-value as
+            a string (2).
+        """
+        for columns in self.run(self.combined_command.format(
+                org1=org1, database=_COMBINED_PROTEOME, n_threads=threads,
+                evalue=evalue, max_targets=max_targets).split()):
+            yield columns[0], columns[1], columns[10]
+
+
+class MMseqsSearch(CommandSearch):
+    """ Searches homologous proteins with MMseqs2. MMseqs2 can only write
+    its hits to a file, so it writes them to a temporary directory of
+    its own (replacing '{directory}' in the commands), from which the
+    hits are read afterwards.
+    """
+
+    def run(self, command):
+        """ Runs a search command and yields the columns of every line
+        of the hits, see 'CommandSearch.run'.
+
+        Parameters:
+            command (list of strings): The command to run.
+        Returns:
+            1. Generator: yields lists of columns.
+        """
+        with tempfile.TemporaryDirectory(prefix="mmseqs_") as directory:
+            command = [part.replace("{directory}", directory)
+                       for part in command]
+            check_command(command, run_command(
+                command, stdout=subprocess.DEVNULL))
+            with open(os.path.join(directory, "hits.m8")) as infile:
+                for line in infile:
+                    yield line.split()
+
+
+class StubSearch(CommandSearch):
+    """ Searches without an external program by reading canned hits
+    from a '{org1}__{org2}.hits' file, which has the query and the
+    hit as first two columns separated by whitespace. This makes it
+    possible to test the pipeline without BLAST.
+    """
+
+    def __init__(self):
+        """ Creates the search. """
+        super(StubSearch, self).__init__("stub", "{org1}__{org2}.hits", "",
+                                         [""], "{org1}__{org2}.hits")
+
+    def make_database(self, organism):
+        """ Does nothing, the stub needs no database. """
+
+    def run(self, command):
+        """ Reads canned hits and yields the columns of every line.
+
+        Parameters:
+            command (list of strings): The name of the file with hits.
+        Returns:
+            1. Generator: yields lists of columns.
+        """
+        with open(command[0]) as infile:
+            for line in infile:
+                if line.strip():
+                    yield line.split()
+
+    def search_combined(self, org1, organisms, threads, evalue, max_targets):
+        """ Reads the canned hits of organism 1 against every other
+        organism as if they came from a search against the database of
+        all organisms, see 'CommandSearch.search_combined'. The canned
+        hits have no e-value, so they are all given an e-value of 0.
+        """
+        for index, org2 in enumerate(organisms):
+            if org2 != org1:
+                for query, hit in self.search(org1, org2, threads):
+                    yield query, "o{}_{}".format(index, hit), "0"
+
+
+_SEARCHES = {
+    "blastp": CommandSearch(
+        "blastp", _BLAST_COMMAND, _MAKEBLASTDB_COMMAND, [".pin", ".pal"],
+        "blastp -outfmt 6 -query {org1}.fa -db {database}.fa " +
+        "-evalue {evalue} -max_target_seqs {max_targets} " +
+        "-num_threads {n_threads}"),
+    "diamond": CommandSearch(
+        "diamond", "diamond blastp --query {org1}.fa --db {org2}.fa.dmnd " +
+        "--outfmt 6 qseqid sseqid --evalue 1e-10 --threads {n_threads} " +
+        "--quiet",
+        "diamond makedb --in {organism}.fa --db {organism}.fa.dmnd --quiet",
+        [".dmnd"],
+        "diamond blastp --query {org1}.fa --db {database}.fa.dmnd " +
+        "--outfmt 6 --evalue {evalue} --max-target-seqs {max_targets} " +
+        "--threads {n_threads} --quiet"),
+    "mmseqs": MMseqsSearch(
+        "mmseqs", "mmseqs easy-search {org1}.fa {org2}.fa.mmseqs " +
+        "{{directory}}/hits.m8 {{directory}}/tmp -e 1e-10 --threads " +
+        "{n_threads} --format-output query,target -v 1",
+        "mmseqs createdb {organism}.fa {organism}.fa.mmseqs -v 1",
+        [".mmseqs"],
+        "mmseqs easy-search {org1}.fa {database}.fa.mmseqs " +
+        "{{directory}}/hits.m8 {{directory}}/tmp -e {evalue} --max-seqs " +
+        "{max_targets} --threads {n_threads} -v 1"),
+    "stub": StubSearch(),
+}
+
+
+def get_search():
+    """ Retrieves the homology search chosen with '--search <name>' on
+    the command line. The names are the keys of _SEARCHES, the default
+    is 'blastp'.
+
+    Parameters:
+        -
+    Returns:
+        1. CommandSearch: The search.
+    """
+    name = get_argument("--search", "blastp")
+    if name not in _SEARCHES:
+        raise Exception("Unknown search '{}', choose from: {}".format(
+            name, ", ".join(sorted(_SEARCHES))))
+    return _SEARCHES[name]
+
+
+def first_hits(hits):
+    """ Only keeps the first (and thus the best) hit of each query.
+    BLAST reports all hits of a query after each other, so this does
+    not need to remember all queries.
+
+    Parameters:
+        hits (iterable): Tuples with the query (0) and the hit (1).
+    Returns:
+        1. Generator: yields the first tuple of each query.
+    """
+    prev_prot = None
+    for hit in hits:
+        if hit[0] != prev_prot:
+            prev_prot = hit[0]
+            yield hit
+
+
+def write_result_file(result_file, lines):
+    """ Writes lines to a file. The file is only created when all lines
+    are written, so a failure while producing the lines (for instance a
+    failing BLAST) never leaves a partial result behind.
+
+    Parameters:
+        result_file (string): The name of the file.
+        lines (iterable of strings): The lines, including line endings.
+    Returns:
+        -
+    """
+    try:
+        with open(result_file + ".tmp", "w") as outfile:
+            outfile.writelines(lines)
+    except BaseException:
+        if os.path.exists(result_file + ".tmp"):
+            os.remove(result_file + ".tmp")
+        raise
+    os.replace(result_file + ".tmp", result_file)
+
+
+def blast_pair(org1, org2, threads, search):
+    """ BLASTs the proteome of organism 1 against the database of
+    organism 2. Only the accessions of the query and the hit are kept
+    and written as '{query};{hit}' to the {org1}__{org2} file.
+
+    Parameters:
+        org1 (string): The name of the first organism
+        org2 (string): The name of the second organism
+        threads (int): The amount of threads BLAST should use.
+        search (CommandSearch): The homology search to use.
+    Returns:
+        -
+    """
+    write_result_file("{}__{}".format(org1, org2), (
+        "{};{}\n".format(query, hit)
+        for query, hit in search.search(org1, org2, threads)))
+
+
+def blast_pair_direct(org1, org2, threads, protein_ids, search):
+    """ BLASTs the proteome of organism 1 against the database of
+    organism 2 and directly writes the best hit of each query to the
+    {org1}_direct_{org2} file, using the protein ID's instead of the
+    accessions. This is the same result as 'blast_pair',
+    'write_direct_hits' and 'write_protein_ids' together, without the
+    BLAST results ever being written to disk.
+
+    Parameters:
+        org1 (string): The name of the first organism
+        org2 (string): The name of the second organism
+        threads (int): The amount of threads BLAST should use.
+        protein_ids (dictionary): The dictionary as returned by
+            'read_protein_ids'.
+        search (CommandSearch): The homology search to use.
+    Returns:
+        -
+    """
+    ids1, ids2 = protein_ids[org1], protein_ids[org2]
+    write_result_file("{}_direct_{}".format(org1, org2), (
+        "{};{}\n".format(ids1[query], ids2[hit])
+        for query, hit in first_hits(search.search(org1, org2, threads))))
+
+
+def combined_proteome_lines(organisms, residues):
+    """ Creates the lines of a fasta file with the proteomes of all
+    organisms. The name of every protein is prefixed with 'o{index}_',
+    where index is the position of its organism in the list, so the
+    organism of a hit can be told from its accession.
+
+    Parameters:
+        organisms (list of strings): The organisms which are used in
+            this COG program.
+        residues (dictionary): Is filled with the names of the
+            organisms as keys and the amount of residues of their
+            proteomes as values.
+    Returns:
+        1. Generator: yields the lines of the fasta file.
+    """
+    for index, organism in enumerate(organisms):
+        residues[organism] = 0
+        with FastaIndex(organism + ".fa") as proteome:
+            for name, sequence in proteome.records():
+                residues[organism] += len(sequence)
+                yield ">o{}_{}\n".format(index, name)
+                for i in range(0, len(sequence), 80):
+                    yield sequence[i:i + 80] + "\n"
+
+
+def search_combined_organism(org1, organisms, threads, search, residues,
+                             protein_ids=None):
+    """ Searches the proteome of organism 1 once against the database of
+    all organisms and splits the best hits per query by the organism
+    they are in. This writes the same files as searching organism 1
+    against each other organism on its own: with protein ID's to
+    {org1}_direct_{org2} when protein ID's are given, otherwise the
+    accessions to {org1}__{org2}.
+    The e-values of a search depend on the size of the database. To
+    use the same cut-off as a search against one organism, the search
+    uses a higher cut-off and every hit is checked after scaling its
+    e-value back to the amount of residues of the organism it is in.
+    The amount of hits per query is limited to
+    _COMBINED_TARGETS_PER_ORGANISM per organism.
+
+    Parameters:
+        org1 (string): The name of the query organism.
+        organisms (list of strings): The organisms which are used in
+            this COG program.
+        threads (int): The amount of threads the search should use.
+        search (CommandSearch): The homology search to use.
+        residues (dictionary): The amount of residues per organism, as
+            filled by 'combined_proteome_lines'.
+        protein_ids (dictionary): The dictionary as returned by
+            'read_protein_ids', or None to write accessions.
+    Returns:
+        -
+    """
+    targets = [org2 for org2 in organisms if org2 != org1]
+    total = sum(residues.values())
+    evalue = _EVALUE * total / max(1, min(residues[org2] for org2 in targets))
+    result_files = {org2: combined_result_file(org1, org2, protein_ids)
+                    for org2 in targets}
+    outfiles = {org2: open(result_files[org2] + ".tmp", "w")
+                for org2 in targets}
+    seen = set()
+    try:
+        for query, hit, hit_evalue in search.search_combined(
+                org1, organisms, threads, evalue,
+                _COMBINED_TARGETS_PER_ORGANISM * len(targets)):
+            tag, hit = hit.split("_", 1)
+            org2 = organisms[int(tag[1:])]
+            if org2 == org1 or (query, org2) in seen:
+                continue
+            seen.add((query, org2))
+            if float(hit_evalue) * residues[org2] / total > _EVALUE:
+                continue
+            if protein_ids is not None:
+                query, hit = protein_ids[org1][query], protein_ids[org2][hit]
+            outfiles[org2].write("{};{}\n".format(query, hit))
+    except BaseException:
+        for org2, outfile in outfiles.items():
+            outfile.close()
+            os.remove(result_files[org2] + ".tmp")
+        raise
+    for org2, outfile in outfiles.items():
+        outfile.close()
+        os.replace(result_files[org2] + ".tmp", result_files[org2])
+
+
+def combined_result_file(org1, org2, protein_ids):
+    """ Gives the file to which 'search_combined_organism' writes the
+    hits of organism 1 against organism 2.
+
+    Parameters:
+        org1 (string): The name of the first organism
+        org2 (string): The name of the second organism
+        protein_ids (dictionary): The protein ID's, or None.
+    Returns:
+        1. String: The name of the file.
+    """
+    if protein_ids is not None:
+        return "{}_direct_{}".format(org1, org2)
+    return "{}__{}".format(org1, org2)
+
+
+def blast_combined(organisms, threads, jobs, search, make_database,
+                   protein_ids, manifest):
+    """ Searches every organism once against a database of all
+    organisms using 'search_combined_organism', instead of searching
+    every pair of organisms. Organisms of which the manifest knows all
+    result files are made from the current proteomes are skipped. The
+    fasta file and the database of all organisms are only made when an
+    organism is left to search.
+
+    Parameters:
+        organisms (list of strings): The organisms which are used in
+            this COG program.
+        threads (int): The amount of threads per search.
+        jobs (int): The amount of searches which run at the same time.
+        search (CommandSearch): The homology search to use.
+        make_database (boolean): Whether to create the database of all
+            organisms when it is not up to date.
+        protein_ids (dictionary): The dictionary as returned by
+            'read_protein_ids', or None to write accessions.
+        manifest (Manifest): Remembers which databases and results are
+            already made.
+    Returns:
+        -
+    """
+    if search.combined_command is None:
+        raise Exception("The {} search cannot search against all "
+                        "organisms at once!".format(search.name))
+    key = manifest.input_key(organisms, search.key, _EVALUE,
+                             _COMBINED_TARGETS_PER_ORGANISM,
+                             protein_ids is not None)
+    queries = [org1 for org1 in organisms if not all(
+        manifest.has_result(combined_result_file(org1, org2, protein_ids),
+                            key)
+        for org2 in organisms if org2 != org1)]
+    if not queries:
+        return
+    residues = dict()
+    write_result_file(_COMBINED_PROTEOME + ".fa",
+                      combined_proteome_lines(organisms, residues))
+    if make_database and not manifest.has_database(_COMBINED_PROTEOME,
+                                                   search):
+        search.make_database(_COMBINED_PROTEOME)
+        manifest.add_database(_COMBINED_PROTEOME, search)
+    queries.sort(key=lambda org1: residues[org1], reverse=True)
+
+    def add_results(org1, *_):
+        for org2 in organisms:
+            if org2 != org1:
+                manifest.add_result(
+                    combined_result_file(org1, org2, protein_ids), key)
+    run_jobs(search_combined_organism,
+             [(org1, organisms, threads, search, residues, protein_ids)
+              for org1 in queries], jobs, "Search", add_results)
+
+
+def read_protein_ids(organisms, protein_id=1):
+    """ Determines the ID of every protein without filling the
+    database, by reading only the names in the index of the fasta files
+    (see 'FastaIndex'). The ID's
+    are assigned in exactly the same way as 'fill_protein_table' does.
+
+    Parameters:
+        organisms (list of strings): The organisms which are used in
+            this COG program.
+        protein_id (int): The ID of the first protein.
+    Returns:
+        1. Dictionary: A dictionary with organism names as keys and
+        as values a dictionary which maps the accessions of that
+        organism to protein ID's (as strings).
+    """
+    protein_ids = dict()
+    for organism in organisms:
+        protein2id = protein_ids[organism] = dict()
+        with FastaIndex(organism + ".fa") as proteome:
+            for name in proteome.names():
+                protein2id[name.split()[0]] = str(protein_id)
+                protein_id += 1
+    return protein_ids
+
+
+def read_database_protein_ids(cursor, organisms):
+    """ Retrieves the ID of every protein of organisms which are
+    already in the database, in the same form as 'read_protein_ids'.
+
+    Parameters:
+        cursor (psycopg2 cursor class): The cursor to execute queries
+            with.
+        organisms (list of strings): The organisms in the database, in
+            the order of their database ID.
+    Returns:
+        1. Dictionary: A dictionary with organism names as keys and
+        as values a dictionary which maps the accessions of that
+        organism to protein ID's (as strings).
+    """
+    protein_ids = dict()
+    for org_id, organism in enumerate(organisms, 1):
+        cursor.execute("""
+            SELECT name, protein_id
+            FROM protein
+            WHERE organism = %s
+            ORDER BY protein_id ASC""", (org_id,))
+        protein_ids[organism] = {name.split()[0]: str(protein_id)
+                                 for name, protein_id in cursor}
+    return protein_ids
+
+
+def organism_pairs(organisms, new_organisms=None):
+    """ Creates every ordered pair of two different organisms. When new
+    organisms are given, only the pairs which contain at least one of
+    the new organisms are created.
+
+    Parameters:
+        organisms (list of strings): The organisms which are used in
+            this COG program.
+        new_organisms (list of strings): The organisms which are added
+            to the database, or None when all organisms are new.
+    Returns:
+        1. List: A list of tuples with the names of the first (0) and
+        second (1) organism.
+    """
+    if new_organisms is None:
+        new_organisms = organisms
+    return [(org1, org2) for org1 in organisms for org2 in organisms
+            if org1 != org2 and (org1 in new_organisms or
+                                 org2 in new_organisms)]
+
+
+def run_jobs(function, arguments, jobs, description, on_done=None):
+    """ Runs a function for every set of arguments with a maximum of
+    'jobs' functions running at the same time. The functions are
+    expected to mostly wait on external programs, so threads are used.
+    After every finished function the progress is reported.
+
+    Parameters:
+        function (function): The function to execute.
+        arguments (list of tuples): The arguments for each call.
+        jobs (int): The amount of functions which may run at the same
+            time.
+        description (string): Describes the jobs in the progress report.
+        on_done (function): Called with the arguments of every finished
+            function, from the calling thread.
+    Returns:
+        -
+    """
+    if not arguments:
+        return
+    pool = ThreadPool(max(1, min(jobs, len(arguments))))
+    try:
+        for done, args in enumerate(pool.imap_unordered(
+                lambda args: (function(*args), args)[1], arguments), 1):
+            if on_done is not None:
+                on_done(*args)
+            print("{}: {}/{} done".format(description, done, len(arguments)))
+    except BaseException:
+        stop_processes(pool)
+        raise
+    finally:
+        pool.terminate()
+
+
+def write_direct_hits(org1, org2):
+    """ Retrieves the first BLAST hit from each protein and writes it
+    to another file. The BLAST files have the format {org1}__{org2}
+    which contain all the BLAST results for all the proteins from
+    organism 1. For each protein the first result
+    (and thus the best result) is retrieved and written to
+    the {org1}_direct_{org2} file.
+
+    Parameters:
+        org1 (string): The name of the first organism
+        org2 (string): The name of the second organism
+    Returns:
+        -
+    """
+    with open("{}_direct_{}".format(org1, org2), "w") as out:
+        with open("{}__{}".format(org1, org2)) as infile:
+            prev_prot = ""
+            for result_line in infile:
+                prot1, prot2 = result_line.split(";")
+                if prot1 != prev_prot:
+                    prev_prot = prot1
+                    out.write(result_line)
+
+
+def blast_organisms(organisms, new_organisms=None, protein_ids=None,
+                    manifest=None):
+    """ Executes the BLAST and makeblastdb commands based on the
+    settings given on the command line. Those settings are handled by
+    the function 'handle_blast_arguments'. Not dependent on those
+    settings is that the directional hits from the BLAST results are
+    written using the 'write_direct_hits' function. This means that
+    BLAST results must be available whether a BLAST is executed or not.
+    Multiple BLAST commands run at the same time, where the pairs with
+    the largest proteomes are started first so they do not hold up the
+    end of the run.
+    BLAST can be replaced by another homology search with
+    '--search <name>', see 'get_search'. With '--combined-search' every
+    organism is searched once against a database of all organisms
+    using 'blast_combined', unless only new organisms are added.
+    With '--stream-hits' on the command line, the direct hits are
+    taken from the output of BLAST while it runs and are written with
+    protein ID's using 'blast_pair_direct'. No {org1}__{org2} files are
+    written then, and without BLAST the direct hit files of an earlier
+    streamed run are used as they are.
+    When new organisms are given, only those get a BLAST database and
+    only the pairs containing a new organism are BLASTed. Databases and
+    pairs of which the manifest knows they are made from the current
+    proteomes are not made again.
+
+    Parameters:
+        organisms (list of strings): The organisms which are used in
+            this COG program.
+        new_organisms (list of strings): The organisms which are added
+            to the database, or None when all organisms are new.
+        protein_ids (dictionary): The protein ID's as returned by
+            'read_protein_ids'. When given, the direct hits are always
+            streamed using these ID's.
+        manifest (Manifest): Remembers which databases and pairs are
+            already made. Defaults to a disabled manifest.
+    Returns:
+        -
+    """
+    if manifest is None:
+        manifest = Manifest(enabled=False)
+    do_blast, make_databases, threads, jobs = handle_blast_arguments()
+    cores = threads * jobs
+    search = get_search()
+    combined = new_organisms is None and "--combined-search" in sys.argv
+    if make_databases and not combined:
+        run_jobs(search.make_database,
+                 [(org,) for org in new_organisms or organisms
+                  if not manifest.has_database(org, search)],
+                 cores, "Databases",
+                 lambda org: manifest.add_database(org, search))
+    pairs = organism_pairs(organisms, new_organisms)
+    stream_hits = protein_ids is not None or "--stream-hits" in sys.argv
+    if do_blast and stream_hits and protein_ids is None:
+        protein_ids = read_protein_ids(organisms)
+    if do_blast and combined:
+        blast_combined(organisms, threads, jobs, search, make_databases,
+                       protein_ids, manifest)
+    elif do_blast:
+        keys = dict()
+        for org1, org2 in pairs:
+            if stream_hits:
+                result_file = "{}_direct_{}".format(org1, org2)
+                first_ids = [min(map(int, protein_ids[org].values()),
+                                 default=0) for org in (org1, org2)]
+            else:
+                result_file = "{}__{}".format(org1, org2)
+                first_ids = None
+            keys[org1, org2] = (result_file, manifest.input_key(
+                [org1, org2], search.key, first_ids))
+        pairs_to_blast = [pair for pair in pairs
+                          if not manifest.has_result(*keys[pair])]
+        sizes = {org: os.path.getsize(org + ".fa") for org in organisms}
+        pairs_to_blast.sort(key=lambda pair: sizes[pair[0]] * sizes[pair[1]],
+                            reverse=True)
+        if stream_hits:
+            run_jobs(blast_pair_direct, [pair + (threads, protein_ids, search)
+                                         for pair in pairs_to_blast], jobs,
+                     "BLAST", lambda org1, org2, *_: manifest.add_result(
+                         *keys[org1, org2]))
+        else:
+            run_jobs(blast_pair, [pair + (threads, search)
+                                  for pair in pairs_to_blast], jobs,
+                     "BLAST", lambda org1, org2, *_: manifest.add_result(
+                         *keys[org1, org2]))
+    if not stream_hits:
+        for org1, org2 in pairs:
+            write_direct_hits(org1, org2)
+
+
+class CopyFile(object):
+    """ A read-only file-like object over lines which are produced one
+    after another, for instance by a generator. This allows COPY to
+    stream rows into the database without the rows being written to
+    disk or collected in memory first.
+    """
+
+    def __init__(self, lines):
+        """ Creates the file-like object.
+
+        Parameters:
+            lines (iterable of strings): The lines, including line
+                endings.
+        """
+        self._lines = iter(lines)
+        self._buffer = ""
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+        data = "".join(chunks)
+        if size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
+
+    def readline(self, size=-1):
+        if self._buffer:
+            line, self._buffer = self._buffer, ""
+            return line
+        return next(self._lines, "")
+
+
+def copy_escape(value):
+    """ Escapes a value for the text format of COPY.
+
+    Parameters:
+        value (string): The value to escape.
+    Returns:
+        1. String: The escaped value.
+    """
+    return (value.replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def protein_copy_rows(records, protein_ids, organism_id):
+    """ Creates the rows to COPY into the protein table.
+
+    Parameters:
+        records (iterable): Tuples with the name (0) and the sequence
+            (1) of a protein, as given by 'FastaIndex.records'.
+        protein_ids (iterator of ints): The ID's for the proteins. Only
+            as many ID's as there are records are taken from it.
+        organism_id (int): The ID of the organism which contains the
+            proteins.
+    Returns:
+        1. Generator: yields the rows as lines in the text format of
+        COPY.
+    """
+    # The records come first so no ID is taken once they run out.
+    for (name, sequence), protein_id in zip(records, protein_ids):
+        yield "{}\t{}\t{}\t{}\n".format(protein_id, copy_escape(name),
+                                         sequence, organism_id)
+
+
+def set_worker_protein_ids(protein_ids):
+    """ Gives the protein ID's to a process of the pool which runs
+    'write_protein_ids', so they are sent to each process only once.
+
+    Parameters:
+        protein_ids (dictionary): The dictionary as returned by
+            'read_protein_ids'.
+    Returns:
+        -
+    """
+    global _WORKER_PROTEIN_IDS
+    _WORKER_PROTEIN_IDS = protein_ids
+
+
+def write_protein_ids(org1, organisms, protein_ids=None):
+    """ Replaces the accession numbers in the direct hit files of
+    organism 1 ({org1}_direct_{org2}) by their corresponding ID in the
+    protein table, on both sides of every hit. Every file belongs to
+    one organism, so the organisms can be handled at the same time.
+    Those files, are later used to insert directly in the database.
+
+    Parameters:
+        org1 (string): The name of the organism.
+        organisms (list of strings): The organisms which are used in
+            this COG program.
+        protein_ids (dictionary): The dictionary as returned by
+            'read_protein_ids', defaults to the one given to this
+            process by 'set_worker_protein_ids'.
+    Returns:
+        -
+    """
+    if protein_ids is None:
+        protein_ids = _WORKER_PROTEIN_IDS
+    for org2 in organisms:
+        if org2 == org1:
+            continue
+        ids1, ids2 = protein_ids[org1], protein_ids[org2]
+        file = "{}_direct_{}".format(org1, org2)
+        with open(file) as infile:
+            with open(file + ".tmp", "w") as outfile:
+                for line in infile:
+                    query, hit = line.strip().split(";")
+                    outfile.write("{};{}\n".format(ids1[query], ids2[hit]))
+        os.replace(file + ".tmp", file)
+
+
+def fill_protein_table(cursor, organism, org_id, prot_id):
+    """ Fills the protein table one organism at a time. This will
+    collect the full name (only the '>' is stripped off) and
+    corresponding sequence from the index of the fasta file (see
+    'FastaIndex'), which are streamed into the table with a single
+    COPY. The proteins get consecutive ID's in the order of the file.
+
+    Parameters:
+        cursor (psycopg2 cursor class): The cursor to execute queries
+            with.
+        organism (string): The name of the organism.
+        org_id (int): The database ID of the organism.
+        prot_id (int): The next ID of a protein.
+    Returns:
+        1. Int: A new protein ID for the next protein.
+    """
+    protein_ids = itertools.count(prot_id)
+    with FastaIndex(organism + ".fa") as proteome:
+        rows = protein_copy_rows(proteome.records(), protein_ids, org_id)
+        cursor.copy_from(CopyFile(rows), "protein", columns=(
+            "protein_id", "name", "sequence", "organism"))
+    next_id = next(protein_ids)
+    _METRICS.count("proteins_loaded", next_id - prot_id)
+    return next_id
+
+
+def first_protein_ids(organisms, protein_id=1):
+    """ Determines the ID of the first protein of every organism by
+    counting the records in the index of the fasta files (see
+    'FastaIndex'). The proteins of an organism get the consecutive
+    ID's after it, the same ID's as when the organisms are loaded one
+    after another, so every organism can be loaded on its own.
+
+    Parameters:
+        organisms (list of strings): The organisms which are used in
+            this COG program.
+        protein_id (int): The ID of the first protein.
+    Returns:
+        1. Dictionary: A dictionary with organism names as keys and the
+        ID of their first protein as values.
+    """
+    first_ids = dict()
+    for organism in organisms:
+        first_ids[organism] = protein_id
+        with FastaIndex(organism + ".fa") as proteome:
+            protein_id += len(proteome)
+    return first_ids
+
+
+def get_storage():
+    """ Retrieves the database chosen with '--storage <name>' on the
+    command line: 'postgres' (default) for the PostgreSQL server of
+    the _DATABASE_SETTINGS, 'sqlite' for an embedded database in the
+    file given with '--sqlite-file <name>' (default _SQLITE_FILE) or
+    'memory' for an embedded database which is only kept in memory.
+
+    Parameters:
+        -
+    Returns:
+        1. String: The name of the storage, one of _STORAGES.
+    """
+    storage = get_argument("--storage", "postgres")
+    if storage not in _STORAGES:
+        raise Exception("Unknown storage '{}', choose from: {}".format(
+            storage, ", ".join(_STORAGES)))
+    return storage
+
+
+def storage_key(storage):
+    """ Describes the database of a storage, so results which are kept
+    in one database are not taken for results in another one.
+
+    Parameters:
+        storage (string): The name of the storage, one of _STORAGES.
+    Returns:
+        1. String: The description.
+    """
+    if storage == "sqlite":
+        return "sqlite:" + os.path.abspath(get_argument("--sqlite-file",
+                                                        _SQLITE_FILE))
+    return storage
+
+
+def connect_database(storage="postgres"):
+    """ Connects to the database of a storage (see 'get_storage'). The
+    cursors of the connection count their round trips.
+
+    Parameters:
+        storage (string): The name of the storage, one of _STORAGES.
+    Returns:
+        1. psycopg2 connection class or EmbeddedConnection: The
+        connection.
+    """
+    if storage == "sqlite":
+        return EmbeddedConnection(get_argument("--sqlite-file", _SQLITE_FILE),
+                                  CountingEmbeddedCursor)
+    if storage == "memory":
+        return EmbeddedConnection(":memory:", CountingEmbeddedCursor)
+    return psycopg2.connect(cursor_factory=CountingCursor,
+                            **_DATABASE_SETTINGS)
+
+
+def is_embedded(connection):
+    """ Checks whether a connection is with an embedded database.
+
+    Parameters:
+        connection (psycopg2 connection class or EmbeddedConnection):
+            The connection with the database.
+    Returns:
+        1. Boolean: Whether the database is embedded.
+    """
+    return isinstance(connection, EmbeddedConnection)
+
+
+def sql_file(connection, name):
+    """ Gives the path of an SQL file next to this script in the
+    dialect of the database: for an embedded database
+    'create_tables.sql' becomes 'create_tables_sqlite.sql'.
+
+    Parameters:
+        connection (psycopg2 connection class or EmbeddedConnection):
+            The connection with the database.
+        name (string): The name of the file for PostgreSQL.
+    Returns:
+        1. String: The path of the file.
+    """
+    if is_embedded(connection):
+        name = name.replace(".sql", "_sqlite.sql")
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+
+def fill_protein_tables(connection, organisms, first_ids, jobs):
+    """ Fills the protein table with 'fill_protein_table' for several
+    organisms at the same time, each over its own connection from a
+    pool of 'jobs' connections. The largest proteomes are started
+    first. Every organism is committed on its own. An embedded
+    database only has a single writer, so there the organisms are
+    loaded one after another over the given connection.
+
+    Parameters:
+        connection (psycopg2 connection class or EmbeddedConnection):
+            The connection with the database.
+        organisms (list of strings): The organisms which are used in
+            this COG program.
+        first_ids (dictionary): The ID of the first protein of every
+            organism, as given by 'first_protein_ids'.
+        jobs (int): The amount of organisms loaded at the same time.
+    Returns:
+        -
+    """
+    if is_embedded(connection):
+        cursor = connection.cursor()
+        for organism in organisms:
+            fill_protein_table(cursor, organism,
+                               organisms.index(organism) + 1,
+                               first_ids[organism])
+            connection.commit()
+        cursor.close()
+        return
+    pool = psycopg2.pool.ThreadedConnectionPool(
+        1, jobs, cursor_factory=CountingCursor, **_DATABASE_SETTINGS)
+
+    def load(organism):
+        connection = pool.getconn()
+        try:
+            cursor = connection.cursor()
+            fill_protein_table(cursor, organism,
+                               organisms.index(organism) + 1,
+                               first_ids[organism])
+            connection.commit()
+            cursor.close()
+        finally:
+            pool.putconn(connection)
+    try:
+        run_jobs(load, [(organism,) for organism in sorted(
+            organisms, key=lambda organism: os.path.getsize(organism + ".fa"),
+            reverse=True)], jobs, "Proteomes")
+    finally:
+        pool.closeall()
+
+
+def fill_bidirectional_hits(connection, cursor):
+    """ Fills the directionalhit table using all the *_direct_* files
+    inserted into a temporary table. Then a query is executed to get
+    all bidirectional hits and the temporary table will be removed.
+
+    Parameters:
+        connection (psycopg2 connection class): The connection with the
+            database.
+        cursor (psycopg2 cursor class): The cursor to execute queries
+            with.
+    Returns:
+        -
+    """
+    os.system("cat *_direct_* > total")
+    with open("total") as infile:
+        cursor.copy_from(infile, "temporaryhit", sep=";",
+                         columns=("protein_a", "protein_b"))
+    connection.commit()
+    os.remove("total")
+    cursor.execute("""
+        INSERT INTO directionalhit (protein_a, protein_b)
+        SELECT protein_a, protein_b FROM (
+          SELECT a.protein_a, a.protein_b
+          FROM temporaryhit a
+            INNER JOIN temporaryhit b
+              ON a.protein_a = b.protein_b AND a.protein_b = b.protein_a
+        ) AS combination_set
+        WHERE protein_a < protein_b""")
+    cursor.execute("DROP TABLE temporaryhit")
+    connection.commit()
+
+
+def read_direct_hits(org1, org2):
+    """ Reads the direct hits of organism 1 against organism 2 after the
+    accessions are replaced by protein ID's.
+
+    Parameters:
+        org1 (string): The name of the first organism
+        org2 (string): The name of the second organism
+    Returns:
+        1. Generator: yields tuples with the protein ID of the query (0)
+        and the protein ID of the hit (1).
+    """
+    with open("{}_direct_{}".format(org1, org2)) as infile:
+        for line in infile:
+            query, hit = line.split(";")
+            yield int(query), int(hit)
+
+
+def bidirectional_hits(org1, org2):
+    """ Finds the bidirectional hits between two organisms. The direct
+    hits of organism 1 are kept in a set, which is used as an index on
+    (query, hit) while the direct hits of organism 2 are read.
+
+    Parameters:
+        org1 (string): The name of the first organism
+        org2 (string): The name of the second organism
+    Returns:
+        1. Generator: yields tuples of two protein ID's, where the
+        lowest protein ID comes first.
+    """
+    hits = set(read_direct_hits(org1, org2))
+    for protein_b, protein_a in read_direct_hits(org2, org1):
+        if (protein_a, protein_b) in hits:
+            yield min(protein_a, protein_b), max(protein_a, protein_b)
+
+
+def fill_bidirectional_hits_in_process(connection, cursor, organisms,
+                                       new_organisms=None):
+    """ Fills the directionalhit table with the same bidirectional hits
+    as 'fill_bidirectional_hits', but finds them in this program
+    instead of the database. Only one pair of organisms is in memory at
+    a time and only the bidirectional hits are sent to the database,
+    using COPY. The temporary table is not used and will be removed.
+
+    Parameters:
+        connection (psycopg2 connection class): The connection with the
+            database.
+        cursor (psycopg2 cursor class): The cursor to execute queries
+            with.
+        organisms (list of string): The organisms which are used in
+            this COG program.
+        new_organisms (list of strings): The organisms which are added
+            to the database, or None when all organisms are new. Only
+            the bidirectional hits with new organisms are added.
+    Returns:
+        -
+    """
+    rows = ("{};{}\n".format(protein_a, protein_b)
+            for org1, org2 in organism_pairs(organisms, new_organisms)
+            if organisms.index(org1) < organisms.index(org2)
+            for protein_a, protein_b in bidirectional_hits(org1, org2))
+    cursor.copy_from(CopyFile(rows), "directionalhit", sep=";",
+                     columns=("protein_a", "protein_b"))
+    cursor.execute("DROP TABLE IF EXISTS temporaryhit")
+    connection.commit()
+
+
+def fill_database(connection, cursor, organisms):
+    """ The main function which fills the database tables except for
+    the cog and multiplesequencealignment tables. The tables are filled
+    in the following order:
+      1. organism table
+      2. protein table
+      3. directionalhit table
+    The bidirectional hits are found by the database, unless
+    '--in-process-hits' is given on the command line.
+    With '--load-jobs <int>' that many organisms are loaded at the same
+    time over a pool of connections (see 'fill_protein_tables'), while
+    the accessions in the direct hit files are replaced by protein ID's
+    in as many processes. The ID's of every organism are determined
+    up front by 'first_protein_ids', so they do not depend on the
+    order in which the organisms are loaded.
+
+    Parameters:
+        connection (psycopg2 connection class): The connection with the
+            database.
+        cursor (psycopg2 cursor class): The cursor to execute queries
+            with.
+        organisms (list of string): The organisms which are used in
+            this COG program.
+    Returns:
+        -
+    """
+    bulk_insert = []
+    for organism in organisms:
+        bulk_insert.append(
+            "INSERT INTO organism (name) VALUES ('{}')".format(organism))
+    cursor.execute(";".join(bulk_insert))
+    connection.commit()
+    jobs = get_int_argument("--load-jobs", 1)
+    first_ids = first_protein_ids(organisms)
+    protein_ids = None
+    if "--stream-hits" not in sys.argv:
+        protein_ids = read_protein_ids(organisms)
+    if jobs > 1:
+        with Pool(jobs, set_worker_protein_ids, (protein_ids,)) as pool:
+            rewrites = pool.starmap_async(write_protein_ids, [
+                (organism, organisms)
+                for organism in organisms if protein_ids is not None])
+            with _METRICS.stage("fill_protein_tables"):
+                fill_protein_tables(connection, organisms, first_ids, jobs)
+            with _METRICS.stage("write_protein_ids"):
+                rewrites.get()
+    else:
+        for organism in organisms:
+            with _METRICS.stage("fill_protein_table", organism):
+                fill_protein_table(cursor, organism,
+                                   organisms.index(organism) + 1,
+                                   first_ids[organism])
+            if protein_ids is not None:
+                with _METRICS.stage("write_protein_ids", organism):
+                    write_protein_ids(organism, organisms, protein_ids)
+        connection.commit()
+    with _METRICS.stage("fill_bidirectional_hits"):
+        if "--in-process-hits" in sys.argv:
+            fill_bidirectional_hits_in_process(connection, cursor, organisms)
+        else:
+            fill_bidirectional_hits(connection, cursor)
+
+
+def add_constraints(connection, cursor):
+    """ Adds the primary keys, foreign keys and indexes of the protein
+    and directionalhit tables with create_constraints.sql. This is done
+    after the tables are loaded, which is faster than checking the keys
+    and updating the indexes for every row that is loaded. The indexes
+    on protein(cog), protein(organism) and directionalhit(protein_a,
+    protein_b) are used by the queries of the later stages, those on
+    the accessions of the proteins and multiplesequencealignment(cog)
+    by cog_lookup.py. An embedded database only gets the indexes, see
+    create_constraints_sqlite.sql.
+
+    Parameters:
+        connection (psycopg2 connection class): The connection with the
+            database.
+        cursor (psycopg2 cursor class): The cursor to execute queries
+            with.
+    Returns:
+        -
+    """
+    with open(sql_file(connection, "create_constraints.sql")) as sql:
+        cursor.execute(sql.read())
+    connection.commit()
+
+
+def analyze_tables(connection, cursor):
+    """ Updates the statistics of the tables which are used to find the
+    cogs, so the planner knows their sizes after a bulk load.
+
+    Parameters:
+        connection (psycopg2 connection class): The connection with the
+            database.
+        cursor (psycopg2 cursor class): The cursor to execute queries
+            with.
+    Returns:
+        -
+    """
+    cursor.execute("ANALYZE organism; ANALYZE protein; ANALYZE cog; " +
+                   "ANALYZE directionalhit")
+    connection.commit()
+
+
+class TwogGraph(object):
+    """ Holds the twogs (bidirectional hits) as an adjacency structure
+    which maps every protein ID to the protein ID's it has a twog with.
+    Looking up a twog is done in constant time and removing all twogs
+    of a protein only takes as long as the amount of twogs of that
+    protein. The order in which the twogs are added is remembered, so
+    iterating over the graph yields the twogs in the same order as the
+    list of tuples which it replaces.
+    """
+
+    def __init__(self, twogs=()):
+        """ Creates the graph.
+
+        Parameters:
+            twogs (iterable): Tuples which contain a bidirectional hit
+                using protein ID's.
+        """
+        self._twogs = dict()
+        self._neighbours = dict()
+        self._next_index = 0
+        for protein1, protein2 in twogs:
+            self.add(protein1, protein2)
+
+    def __contains__(self, twog):
+        return twog[1] in self._neighbours.get(twog[0], ())
+
+    def __iter__(self):
+        return iter(list(self._twogs))
+
+    def __len__(self):
+        return len(self._twogs)
+
+    def add(self, protein1, protein2):
+        """ Adds a twog to the graph, when it is not already in it.
+
+        Parameters:
+            protein1 (int): The ID of the first protein.
+            protein2 (int): The ID of the second protein.
+        Returns:
+            -
+        """
+        if (protein1, protein2) in self:
+            return
+        twog = (protein1, protein2)
+        self._twogs[twog] = self._next_index
+        self._next_index += 1
+        self._neighbours.setdefault(protein1, dict())[protein2] = twog
+        self._neighbours.setdefault(protein2, dict())[protein1] = twog
+
+    def indexed_neighbours(self, protein):
+        """ Retrieves the proteins which have a twog with the given
+        protein along with the index of that twog. The index represents
+        the position of the twog in the order in which it was added.
+
+        Parameters:
+            protein (int): The ID of the protein.
+        Returns:
+            1. List: A list of tuples which contain the index of the
+            twog (0) and the ID of the neighbouring protein (1).
+        """
+        twogs = self._neighbours.get(protein, dict())
+        return [(self._twogs[twog], neighbour)
+                for neighbour, twog in twogs.items()]
+
+    def neighbours(self, protein):
+        """ Retrieves the proteins which have a twog with the given
+        protein, in the order in which those twogs were added.
+
+        Parameters:
+            protein (int): The ID of the protein.
+        Returns:
+            1. List: A list of protein ID's.
+        """
+        return [neighbour for _, neighbour in
+                sorted(self.indexed_neighbours(protein))]
+
+    def remove_proteins(self, remove_containing):
+        """ Removes twogs which contain a protein ID specified in
+        remove_containing.
+
+        Parameters:
+            remove_containing (iterable of ints): Protein ID's.
+        Returns:
+            -
+        """
+        for protein in remove_containing:
+            for neighbour, twog in self._neighbours.pop(
+                    protein, dict()).items():
+                del self._neighbours[neighbour][protein]
+                if not self._neighbours[neighbour]:
+                    del self._neighbours[neighbour]
+                del self._twogs[twog]
+
+
+class TwogStore(object):
+    """ Holds all bidirectional hits along with the organism ID's of
+    their proteins, partitioned by the pair of organisms they connect.
+    The twogs of a pair of organisms are therefore fetched without
+    looking at any other twog. The proteins of each organism which
+    have a twog are also collected once, in the order they are found.
+    """
+
+    def __init__(self, rows):
+        """ Creates the store.
+
+        Parameters:
+            rows (iterable): Tuples with the protein ID's of a
+                bidirectional hit (0 and 1) and the organism ID's of
+                those proteins (2 and 3).
+        """
+        self._pairs = dict()
+        self._proteins = dict()
+        for protein1, protein2, organism1, organism2 in rows:
+            key = (min(organism1, organism2), max(organism1, organism2))
+            if key not in self._pairs:
+                self._pairs[key] = array("q")
+            self._pairs[key].extend((protein1, protein2))
+            self._proteins.setdefault(organism1, dict())[protein1] = None
+            self._proteins.setdefault(organism2, dict())[protein2] = None
+
+    def pair_twogs(self, organism_id1, organism_id2):
+        """ Retrieves the twogs between two organisms.
+
+        Parameters:
+            organism_id1 (int): The organism ID of organism 1.
+            organism_id2 (int): The organism ID of organism 2.
+        Returns:
+            1. Iterator: yields tuples containing a bidirectional hit.
+        """
+        twogs = self._pairs.get((min(organism_id1, organism_id2),
+                                 max(organism_id1, organism_id2)), ())
+        return zip(twogs[0::2], twogs[1::2])
+
+    def organism_proteins(self, organism_id, skip_proteins):
+        """ Retrieves a set of protein ID's which belong to the given
+        organism ID. This reduces the amount of loops which 'new_cogs'
+        has to do. Proteins which are not in the bidirectionalhits will
+        never be participating in a COG.
+
+        Parameters:
+            organism_id (int): The database ID of the organism.
+            skip_proteins (list of ints): A list of integers which are
+                already in cogs according to the function 'update_cogs'.
+        Returns:
+            1. Set: A set of protein ID's which are used in 'new_cogs'.
+        """
+        skip_proteins = set(skip_proteins)
+        return set(protein for protein in self._proteins.get(organism_id, ())
+                   if protein not in skip_proteins)
+
+
+class CogAssignments(object):
+    """ Collects the new cogs and the proteins which are added to cogs,
+    so they can be written to the database at once instead of with a
+    query for every cog.
+    """
+
+    def __init__(self):
+        """ Creates an empty collection of assignments. """
+        self.cogs = []
+        self.proteins = OrderedDict()
+
+    def assign(self, cog, proteins):
+        """ Adds proteins to a cog.
+
+        Parameters:
+            cog (int): The cog ID.
+            proteins (iterable of ints): The protein ID's.
+        Returns:
+            -
+        """
+        for protein in proteins:
+            self.proteins[protein] = cog
+
+    def add_cog(self, cog, proteins):
+        """ Adds a new cog with its proteins.
+
+        Parameters:
+            cog (int): The cog ID.
+            proteins (iterable of ints): The protein ID's.
+        Returns:
+            -
+        """
+        self.cogs.append(cog)
+        self.assign(cog, proteins)
+
+    def flush(self, cursor):
+        """ Writes the collected cogs and assignments to the database.
+        The new cogs are inserted with a single COPY, so the amount of
+        cogs is not limited by the amount of parameters of a query. The
+        assignments are copied into a staging table and applied with a
+        single UPDATE. Afterwards the collection is empty.
+
+        Parameters:
+            cursor (psycopg2 cursor class): The cursor to execute
+                queries with.
+        Returns:
+            -
+        """
+        if self.cogs:
+            cursor.copy_from(CopyFile("{}\n".format(cog) for cog in self.cogs),
+                             "cog", columns=("cog_id",))
+        if self.proteins:
+            cursor.execute("""
+                CREATE TEMPORARY TABLE IF NOT EXISTS cogassignment
+                  (
+                     protein_id INTEGER NOT NULL,
+                     cog        INTEGER NOT NULL
+                  )""")
+            cursor.execute("DELETE FROM cogassignment")
+            cursor.copy_from(CopyFile(
+                "{}\t{}\n".format(protein, cog)
+                for protein, cog in self.proteins.items()),
+                "cogassignment", columns=("protein_id", "cog"))
+            cursor.execute("""
+                UPDATE protein
+                SET cog = cogassignment.cog
+                FROM cogassignment
+                WHERE protein.protein_id = cogassignment.protein_id""")
+        self.cogs = []
+        self.proteins = OrderedDict()
+
+
+def get_cog_proteins(cursor):
+    """ Retrieves the cog number along with the protein ID's contained
+    in it, both in ascending order.
+
+    Parameters:
+        cursor (psycopg2 cursor class): The cursor to execute queries
+            with.
+    Returns:
+        1. Dict: A dictionary with keys as cog ID and as
+        values a list of protein ID's.
+    """
+    cursor.execute("""
+        SELECT cog, protein_id
+        FROM protein
+        WHERE cog IS NOT NULL
+        ORDER BY cog ASC, protein_id ASC""")
+    cog_map = OrderedDict()
+    for cog, protein_id in cursor.fetchall():
+        if cog not in cog_map:
+            cog_map[cog] = []
+        cog_map[cog].append(protein_id)
+    return cog_map
+
+
+def extend_cogs(cog_map, twogs):
+    """ Finds per cog a best matching protein, which is the protein
+    with the most twogs with the proteins in the cog. Only the twogs of
+    the proteins in the cog are visited, in the order in which they
+    were added to the graph, so ties between the best matching proteins
+    are broken the same way for every run. The twogs of the cog and
+    the best matching protein are removed from the graph.
+
+    Parameters:
+        cog_map (dictionary): The cogs (in ascending order) as keys and
+            the protein ID's in them (in ascending order) as values.
+        twogs (TwogGraph): The graph containing bidirectional hits.
+    Returns:
+        1. Generator: yields tuples with the cog (0) and the protein ID
+        of its best matching protein (1).
+    """
+    for cog in cog_map:
+        cog_proteins = cog_map[cog]
+        cog_twogs = []
+        for position, cog_protein in enumerate(cog_proteins):
+            for twog_index, neighbour in twogs.indexed_neighbours(
+                    cog_protein):
+                cog_twogs.append((twog_index, position, neighbour))
+        if not cog_twogs:
+            continue
+        cog_twogs.sort()
+        protein_counter = Counter()
+        for _, _, neighbour in cog_twogs:
+            protein_counter[neighbour] += 1
+        common_protein = protein_counter.most_common(1)[0][0]
+        twogs.remove_proteins(cog_proteins + [common_protein])
+        yield cog, common_protein
+
+
+def update_cogs(cursor, twogs, assignments):
+    """ Adds to every cog its best matching protein, as found by
+    'extend_cogs'.
+
+    Parameters:
+        cursor (psycopg2 cursor class): The cursor to execute queries
+            with.
+        twogs (TwogGraph): The graph containing bidirectional hits.
+        assignments (CogAssignments): Collects the proteins which are
+            added to a cog.
+    Returns:
+        1. List: A list of integers which represent protein ID's
+        which should not be used in the 'new_cogs' function.
+    """
+    skip_proteins = []
+    for cog, common_protein in extend_cogs(get_cog_proteins(cursor), twogs):
+        assignments.assign(cog, [common_protein])
+        skip_proteins.append(common_protein)
+    return skip_proteins
+
+
+def find_new_cogs(proteins, twogs):
+    """ Finds new cogs. A new cog is defined as 3 proteins which have
+    bidirectional hits with each other:
+        A - B
+         \ /
+          C
+    The proteins are tried in the given order and the twogs of every
+    new cog are removed from the graph.
+
+    Parameters:
+        proteins (iterable of ints): The proteins which could start a
+            new cog.
+        twogs (TwogGraph): The graph containing bidirectional hits.
+    Returns:
+        1. Generator: yields tuples with the protein which started the
+        cog (0) and a set with the proteins in the cog (1).
+    """
+    for protein_id in proteins:
+        found_twogs = twogs.neighbours(protein_id)
+        hidden_twogs = set()
+        for found_twogs_index in range(len(found_twogs)):
+            for combine_with in found_twogs[found_twogs_index + 1:]:
+                twog_combo = (found_twogs[found_twogs_index], combine_with)
+                if twog_combo in twogs:
+                    hidden_twogs.update([*twog_combo, protein_id])
+        if len(hidden_twogs):
+            twogs.remove_proteins(hidden_twogs)
+            yield protein_id, hidden_twogs
+
+
+def new_cogs(cursor, twogs, proteins, assignments):
+    """ Adds the cogs found by 'find_new_cogs' with consecutive cog
+    ID's after the highest cog ID in the database.
+
+    Parameters:
+        cursor (psycopg2 cursor class): The cursor to execute queries
+            with.
+        twogs (TwogGraph): The graph containing bidirectional hits.
+        proteins (set of ints): The proteins of the organism which
+            could start a new cog, as given by
+            'TwogStore.organism_proteins'.
+        assignments (CogAssignments): Collects the new cogs.
+    Returns:
+        -
+    """
+    cursor.execute("SELECT MAX(cog_id) FROM cog")
+    cog_id = (cursor.fetchone()[0] or 0) + 1
+    for _, hidden_twogs in find_new_cogs(proteins, twogs):
+        assignments.add_cog(cog_id, hidden_twogs)
+        cog_id += 1
+
+
+def find_cogs(connection, cursor, organisms, first_new=0):
+    """ The main algorithm to find and update cogs. First it will load
+    all bidirectional hits from the database in a TwogStore along with
+    the organism ID's of those proteins. Then for each organism the
+    twogs with all previous organisms are added to the twogs graph and
+    when the more or equal than 3 organism are contained in the twogs,
+    the following sequence will happen:
+      1. Call update_cogs
+      2. Call new_cogs
+      3. Write the cogs found by both functions to the database
+    Both functions remove the twogs which became part of a cog from
+    the graph, so the graph is carried over to the next organism.
+    When organisms are added to existing cogs, the cogs are only found
+    for the new organisms. The graph then starts with the twogs between
+    existing organisms of which neither protein is in a cog, which are
+    exactly the twogs left over after the existing organisms.
+    With '--cog-jobs <int>' the cogs are found by that many processes
+    at the same time, see 'find_cogs_in_components'.
+
+    Parameters:
+        connection (psycopg2 connection class): The connection with the
+            database.
+        cursor (psycopg2 cursor class): The cursor to execute queries
+            with.
+        organisms (list of string): The organisms which are used in
+            this COG program.
+        first_new (int): The index of the first organism which is not
+            processed yet.
+    Returns:
+        -
+    """
+    in_cogs = set()
+    if first_new:
+        cursor.execute("SELECT protein_id FROM protein WHERE cog IS NOT NULL")
+        in_cogs.update(protein_id for protein_id, in cursor)
+    cursor.execute("""SELECT protein_a, protein_b, a.organism, b.organism
+                      FROM directionalhit
+                        INNER JOIN protein a ON a.protein_id = protein_a
+                        INNER JOIN protein b ON b.protein_id = protein_b""")
+    store = TwogStore(cursor)
+    jobs = get_int_argument("--cog-jobs", 1)
+    if jobs > 1:
+        find_cogs_in_components(connection, cursor, organisms, store,
+                                in_cogs, first_new, jobs)
+        return
+    twogs = TwogGraph()
+    for organism1_id in range(len(organisms)):
+        with _METRICS.stage("find_cogs iteration", organisms[organism1_id]):
+            twog_count = len(twogs)
+            for organism2_id in range(organism1_id):
+                for protein1, protein2 in store.pair_twogs(organism1_id + 1,
+                                                           organism2_id + 1):
+                    if organism1_id >= first_new or not (
+                            protein1 in in_cogs or protein2 in in_cogs):
+                        twogs.add(protein1, protein2)
+            _METRICS.count("twogs_processed", len(twogs) - twog_count)
+            if organism1_id > 1 and organism1_id >= first_new:
+                assignments = CogAssignments()
+                skip_proteins = update_cogs(cursor, twogs, assignments)
+                new_cogs(cursor, twogs, store.organism_proteins(
+                    organism1_id + 1, skip_proteins), assignments)
+                _METRICS.count("cogs_extended", len(skip_proteins))
+                _METRICS.count("cogs_created", len(assignments.cogs))
+                assignments.flush(cursor)
+                connection.commit()
+
+
+def component_worker(pipe, iteration_twogs, cog_map):
+    """ Finds the cogs within a part of the connected components of the
+    twog graph, in a process of 'find_cogs_in_components'. The twogs
+    of an organism are added to the graph when the first command for
+    that organism (or a later one) comes in. The commands are received
+    through the pipe as tuples of the command, the index of the
+    organism and the proteins to try:
+      - ("update", organism, None): sends back the tuples of
+        'extend_cogs' for the cogs of this process.
+      - ("new", organism, proteins): tries the proteins, given as
+        tuples with the position of the protein in the proteins of the
+        organism (0) and the protein ID (1), and sends back tuples with
+        that position and the set of proteins of every new cog.
+    A new cog is known by the key (organism, position) until the cog ID
+    is given out. None stops the process. When an error occurs, it is
+    sent back instead of the result.
+
+    Parameters:
+        pipe (multiprocessing connection): The end of the pipe of this
+            process.
+        iteration_twogs (dictionary): The index of an organism as keys
+            and a list of the twogs which are added for that organism
+            as values.
+        cog_map (dictionary): The keys of the existing cogs as keys and
+            a list of their protein ID's in ascending order as values.
+    Returns:
+        -
+    """
+    twogs = TwogGraph()
+    added = 0
+    try:
+        for command, organism, proteins in iter(pipe.recv, None):
+            while added <= organism:
+                for protein1, protein2 in iteration_twogs.pop(added, ()):
+                    twogs.add(protein1, protein2)
+                added += 1
+            if command == "update":
+                extended = list(extend_cogs(
+                    OrderedDict(sorted(cog_map.items())), twogs))
+                for cog, protein in extended:
+                    bisect.insort(cog_map[cog], protein)
+                pipe.send(extended)
+            else:
+                positions = {protein: position
+                             for position, protein in proteins}
+                found = []
+                for protein, cog_proteins in find_new_cogs(
+                        [protein for _, protein in proteins], twogs):
+                    cog_map[organism, positions[protein]] = sorted(
+                        cog_proteins)
+                    found.append((positions[protein], cog_proteins))
+                pipe.send(found)
+    except Exception as error:
+        pipe.send(error)
+
+
+def receive(pipe):
+    """ Receives the result of a command from a 'component_worker'.
+
+    Parameters:
+        pipe (multiprocessing connection): The end of the pipe of the
+            calling process.
+    Returns:
+        1. The result of the command.
+    """
+    result = pipe.recv()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def find_cogs_in_components(connection, cursor, organisms, store, in_cogs,
+                            first_new, jobs):
+    """ Finds the same cogs as 'find_cogs' does on its own, but with
+    'jobs' processes at the same time. A cog never spans two connected
+    components of the twog graph (where the proteins of an existing cog
+    count as connected), so the components are divided over the
+    processes, the largest first, and every process runs
+    'component_worker' on its own part of the graph. For every organism
+    all processes first extend their cogs; the proteins of the
+    organism which may start a new cog are then determined from all
+    extended cogs, in the same order as 'new_cogs' would try them, and
+    every process tries its own proteins in that order. The new cogs
+    are numbered in that order as well, so the cog ID's are the same
+    as those of 'find_cogs'. The cogs are written to the database per
+    organism.
+
+    Parameters:
+        connection (psycopg2 connection class): The connection with the
+            database.
+        cursor (psycopg2 cursor class): The cursor to execute queries
+            with.
+        organisms (list of string): The organisms which are used in
+            this COG program.
+        store (TwogStore): All bidirectional hits.
+        in_cogs (set of ints): The proteins which are already in a cog.
+        first_new (int): The index of the first organism which is not
+            processed yet.
+        jobs (int): The amount of processes.
+    Returns:
+        -
+    """
+    cog_map = get_cog_proteins(cursor) if first_new else OrderedDict()
+    components = dict()
 
-_BLAST_COMMAND = ("blastp -outfmt 6 -query {org1}.fa -db {org2}.fa " +
-                  "-evalue 1e-10 -num_threads {n_threads} " +
-                  "| awk '{{print $1,$2}}' | sed 's/ /;/g'" +
-                  " > {org1}__{org2}")
+    def component(protein):
+        root = protein
+        while components.get(root, root) != root:
+            root = components[root]
+        while protein != root:
+            components[protein], protein = root, components[protein]
+        return root
+    all_twogs = []
+    for organism1_id in range(len(organisms)):
+        for organism2_id in range(organism1_id):
+            for protein1, protein2 in store.pair_twogs(organism1_id + 1,
+                                                       organism2_id + 1):
+                if organism1_id >= first_new or not (
+                        protein1 in in_cogs or protein2 in in_cogs):
+                    all_twogs.append((organism1_id, protein1, protein2))
+                    components[component(protein1)] = component(protein2)
+    for cog_proteins in cog_map.values():
+        for protein in cog_proteins[1:]:
+            components[component(protein)] = component(cog_proteins[0])
+    _METRICS.count("twogs_processed", len(all_twogs))
+    sizes = Counter(component(protein1) for _, protein1, _ in all_twogs)
+    loads = [0] * jobs
+    process_of = dict()
+    for root, size in sorted(sizes.items(),
+                             key=lambda item: (-item[1], item[0])):
+        process_of[root] = loads.index(min(loads))
+        loads[process_of[root]] += size
+    twogs_of = [dict() for _ in range(jobs)]
+    for organism1_id, protein1, protein2 in all_twogs:
+        twogs_of[process_of[component(protein1)]].setdefault(
+            organism1_id, []).append((protein1, protein2))
+    cogs_of = [dict() for _ in range(jobs)]
+    for cog, cog_proteins in cog_map.items():
+        cogs_of[process_of.get(component(cog_proteins[0]), 0)][
+            -1, cog] = cog_proteins
+    cog_ids = {(-1, cog): cog for cog in cog_map}
+    del all_twogs, cog_map
+    pipes = []
+    processes = []
+    for twogs, cogs in zip(twogs_of, cogs_of):
+        pipe, worker_pipe = Pipe()
+        process = Process(target=component_worker,
+                          args=(worker_pipe, twogs, cogs), daemon=True)
+        process.start()
+        worker_pipe.close()
+        pipes.append(pipe)
+        processes.append(process)
+    del twogs_of, cogs_of
+    cursor.execute("SELECT MAX(cog_id) FROM cog")
+    cog_id = (cursor.fetchone()[0] or 0) + 1
+    try:
+        for organism1_id in range(max(2, first_new), len(organisms)):
+            with _METRICS.stage("find_cogs iteration",
+                                organisms[organism1_id]):
+                assignments = CogAssignments()
+                for pipe in pipes:
+                    pipe.send(("update", organism1_id, None))
+                skip_proteins = []
+                for pipe in pipes:
+                    for key, protein in receive(pipe):
+                        assignments.assign(cog_ids[key], [protein])
+                        skip_proteins.append(protein)
+                proteins = [[] for _ in pipes]
+                for position, protein in enumerate(store.organism_proteins(
+                        organism1_id + 1, skip_proteins)):
+                    proteins[process_of.get(component(protein), 0)].append(
+                        (position, protein))
+                for pipe, process_proteins in zip(pipes, proteins):
+                    pipe.send(("new", organism1_id, process_proteins))
+                found = [cog for pipe in pipes for cog in receive(pipe)]
+                found.sort(key=lambda cog: cog[0])
+                for position, cog_proteins in found:
+                    cog_ids[organism1_id, position] = cog_id
+                    assignments.add_cog(cog_id, cog_proteins)
+                    cog_id += 1
+                _METRICS.count("cogs_extended", len(skip_proteins))
+                _METRICS.count("cogs_created", len(assignments.cogs))
+                assignments.flush(cursor)
+                connection.commit()
+    except BaseException:
+        # A worker may be blocked sending a result which is never read.
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+        raise
+    for pipe, process in zip(pipes, processes):
+        pipe.send(None)
+        process.join()
 
 
-def handle_blast_arguments():
-    """ Handles the arguments given on the command line
-    related to the BLAST settings. The different arguments are:
-    --no-blast: marks the algorithm to not execute the BLAST commands
-    --blast-threads <int>: the amount of threads which
-    the BLAST command should be executed with.
-    --no-blast-dbs: marks the algorithm to not execute the makeblastdb
-    commands.
+def parse_alignment(lines):
+    """ Parses an alignment in the ClustalW format to fit the complete
+    alignment in a string. The parts of each sequence are collected
+    in lists which are only joined at the end, so the time it takes
+    only grows with the size of the alignment. Lines which start with
+    whitespace are the consensus lines. The names are padded to the
+    column of the sequences, widened when a name (such as
+    'consensus') would not fit.
 
     Parameters:
-        -
+        lines (iterable of strings): The lines of the alignment,
+            starting with the header line.
     Returns:
-        1. Boolean: execute BLAST commands
-        2. Boolean: execute makeblastdb commands
-        3. Int: amount of BLAST threads
+        1. String: the complete multiple sequence alignment
     """
-    if "--no-blast" in sys.argv:
-        return False, False, -1
-    threads = 3
-    if "--blast-threads" in sys.argv:
-        index = sys.argv.index("--blast-threads")
-        if (index + 1 < len(sys.argv) and
-                sys.argv[index + 1].strip().isnumeric()):
-            threads = max(1, int(sys.argv[index + 1].strip()))
-    return True, "--no-blast-dbs" not in sys.argv, threads
+    msa = OrderedDict()
+    start_index = 0
+    lines = iter(lines)
+    next(lines, None)
+    for line in lines:
+        if len(line.rstrip("\n")) == 0:
+            continue
+        if line[0].isspace():
+            msa.setdefault("consensus", []).append(
+                line[start_index:].rstrip("\n"))
+        else:
+            accession, sequence = line.split()[:2]
+            msa.setdefault(accession, []).append(sequence)
+            start_index = line.index(sequence, len(accession))
+    width = max([start_index] + [len(accession) + 1 for accession in msa])
+    return "".join("{}{}{}\n".format(
+        accession, " " * (width - len(accession)), "".join(parts))
+        for accession, parts in msa.items())
 
 
-def write_direct_hits(org1, org2):
-    """ Retrieves the first BLAST hit from each protein and writes it
-    to another file. The BLAST files have the format {org1}__{org2}
-    which contain all the BLAST results for all the proteins from
-    organism 1. For each protein the first result
-    (and thus the best result) is retrieved and written to
-    the {org1}_direct_{org2} file.
+def get_msa(file):
+    """ Parses an alignment file to fit the complete alignment in a
+    string instead of a file, using 'parse_alignment'.
 
     Parameters:
-        org1 (string): The name of the first organism
-        org2 (string): The name of the second organism
+        file (string): The name of the file to parse
     Returns:
-        -
+        1. String: the complete multiple sequence alignment
     """
-    with open("{}_direct_{}".format(org1, org2), "w") as out:
-        with open("{}__{}".format(org1, org2)) as infile:
-            prev_prot = ""
-            for result_line in infile:
-                prot1, prot2 = result_line.split(";")
-                if prot1 != prev_prot:
-                    prev_prot = prot1
-                    out.write(result_line)
+    with open(file) as infile:
+        return parse_alignment(infile)
 
 
-def blast_organisms(organisms):
-    """ Executes the BLAST and makeblastdb commands based on the
-    settings given on the command line. Those settings are handled by
-    the function 'handle_blast_arguments'. Not dependent on those
-    settings is that the directional hits from the BLAST results are
-    written using the 'write_direct_hits' function. This means that
-    BLAST results must be available whether a BLAST is executed or not.
+def format_fasta(name_sequence_tuple, accessions_only=False):
+    """ Creates the text of a fasta file, with lines of 80 residues.
 
     Parameters:
-        organisms (list of strings): The organisms which are used in
-            this COG program.
+        name_sequence_tuple (list): A list of tuples which contain the
+            name of the sequence (0) and the sequence itself (1).
+        accessions_only (boolean): Whether to only write the first word
+            of the names.
     Returns:
+        1. String: The fasta text.
+    """
+    lines = []
+    for name, sequence in name_sequence_tuple:
+        lines.append(">" + (name.split()[0] if accessions_only else name))
+        for i in range(0, len(sequence), 80):
+            lines.append(sequence[i:i + 80])
+    return "\n".join(lines) + "\n"
+
+
+class ClustalWAligner(object):
+    """ Aligns with ClustalW. ClustalW can only read and write files, so
+    all files are written to a temporary directory of their own, on the
+    in-memory /dev/shm when available, which is removed afterwards.
+    """
+
+    def align(self, name_sequence_tuple, timeout=None):
+        """ Aligns sequences.
+
+        Parameters:
+            name_sequence_tuple (list): A list of tuples which contain
+                the name of the sequence (0) and the sequence itself
+                (1).
+            timeout (int): The amount of seconds the aligner may take,
+                or None to wait until it finishes.
+        Returns:
+            1. String: the complete multiple sequence alignment.
+        """
+        temp_root = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        with tempfile.TemporaryDirectory(prefix="msa_",
+                                         dir=temp_root) as directory:
+            files = [os.path.join(directory, file) for file in
+                     ("msa_file.fa", "tree_file.dnd", "output.aln")]
+            with open(files[0], "w") as outfile:
+                outfile.write(format_fasta(name_sequence_tuple))
+            command = ("clustalw -infile={} -newtree={} -outfile={} -align " +
+                       "-quiet").format(*files).split()
+            check_command(command, run_command(
+                command, stdout=subprocess.DEVNULL, timeout=timeout))
+            return get_msa(files[2])
+
+
+class PipeAligner(object):
+    """ Aligns with a program which reads the sequences as fasta on its
+    standard input and writes the alignment in the ClustalW format on
+    its standard output, so no files are needed.
+    """
+
+    def __init__(self, command):
+        """ Creates the aligner.
+
+        Parameters:
+            command (string): The command, where '{threads}' is
+                replaced by the amount of threads it may use.
+        """
+        self.command = command
+
+    def align(self, name_sequence_tuple, timeout=None):
+        """ Aligns sequences. The amount of threads the program may use
+        is set with '--aligner-threads <int>' on the command line.
+
+        Parameters:
+            name_sequence_tuple (list): A list of tuples which contain
+                the name of the sequence (0) and the sequence itself
+                (1).
+            timeout (int): The amount of seconds the aligner may take,
+                or None to wait until it finishes.
+        Returns:
+            1. String: the complete multiple sequence alignment.
+        """
+        command = self.command.format(
+            threads=get_int_argument("--aligner-threads", 1)).split()
+        process = run_command(
+            command, input=format_fasta(name_sequence_tuple, True),
+            stdout=subprocess.PIPE, universal_newlines=True, timeout=timeout)
+        check_command(command, process)
+        return parse_alignment(process.stdout.splitlines(True))
+
+
+class StubAligner(object):
+    """ Aligns without an external program by padding every sequence
+    with gaps up to the length of the longest sequence. The result is
+    always the same for the same sequences, which makes it useful for
+    testing the rest of the pipeline.
+    """
+
+    def align(self, name_sequence_tuple, timeout=None):
+        """ Aligns sequences.
+
+        Parameters:
+            name_sequence_tuple (list): A list of tuples which contain
+                the name of the sequence (0) and the sequence itself
+                (1).
+            timeout (int): Not used.
+        Returns:
+            1. String: the complete multiple sequence alignment.
+        """
+        length = max(len(sequence) for _, sequence in name_sequence_tuple)
+        rows = [(name.split()[0], sequence.ljust(length, "-"))
+                for name, sequence in name_sequence_tuple]
+        width = max(len(name) for name, _ in rows) + 6
+        lines = ["CLUSTAL stub alignment\n"]
+        for start in range(0, length, 60):
+            lines.append("\n")
+            for name, sequence in rows:
+                lines.append(name.ljust(width) +
+                             sequence[start:start + 60] + "\n")
+            lines.append(" " * width + "".join(
+                "*" if len(set(column)) == 1 else " "
+                for column in zip(*(sequence[start:start + 60]
+                                    for _, sequence in rows))) + "\n")
+        return parse_alignment(lines)
+
+
+_ALIGNERS = {
+    "clustalw": ClustalWAligner(),
+    "mafft": PipeAligner("mafft --quiet --clustalout --thread {threads} -"),
+    "clustalo": PipeAligner("clustalo -i - --outfmt=clu --threads={threads}"),
+    "muscle": PipeAligner("muscle -quiet -clw"),
+    "stub": StubAligner(),
+}
+
+
+def get_aligner():
+    """ Retrieves the aligner chosen with '--aligner <name>' on the
+    command line. The names are the keys of _ALIGNERS, the default is
+    'clustalw'.
+
+    Parameters:
         -
+    Returns:
+        1. Object: The aligner, which has an 'align' method.
     """
-    do_blast, make_databases, threads = handle_blast_arguments()
-    if make_databases:
-        for organism in organisms:
-            os.system("makeblastdb -in {}.fa -dbtype prot".format(organism))
-    for org1 in organisms:
-        for org2 in organisms:
-            if org1 != org2:
-                if do_blast:
-                    os.system(_BLAST_COMMAND.format(org1=org1, org2=org2,
-                                                    n_threads=threads))
-                write_direct_hits(org1, org2)
+    name = get_argument("--aligner", "clustalw")
+    if name not in _ALIGNERS:
+        raise Exception("Unknown aligner '{}', choose from: {}".format(
+            name, ", ".join(sorted(_ALIGNERS))))
+    return _ALIGNERS[name]
 
 
-def insert_protein(cursor, protein_id, organism_id, protein_name, protein_seq,
-                   protein2id):
-    """ Inserts a protein into the database and also maps a protein
-    name to its ID number. This ID is used later in the general
-    algorithm.
+def compress_msa(msa):
+    """ Compresses a multiple sequence alignment with zlib, to store it
+    in the msa_zlib column.
 
     Parameters:
-        cursor (psycopg2 cursor class): The cursor to execute queries
-            with.
-        protein_id (int): The ID which the to be inserted protein
-            should have.
-        organism_id (int): The ID of the organism which contains this
-            protein.
-        protein_name (string): The name of the protein.
-        protein_seq (string): The amino acid sequence.
-        protein2id (dictionary): The dictionary which has keys as names
-            (practically only the accession) and values as numeric ID's.
+        msa (string): The complete multiple sequence alignment.
     Returns:
-        1. Int: A new protein ID for the next protein.
+        1. Bytes: The compressed alignment.
     """
-    if not protein_name:
-        return protein_id
-    args = (protein_id, protein_name, protein_seq, organism_id)
-    cursor.execute("""
-        INSERT INTO protein (protein_id, name, sequence, organism)
-        VALUES (%s, %s, %s, %s)""", args)
-    protein2id[protein_name.split()[0]] = str(protein_id)
-    return protein_id + 1
+    return zlib.compress(msa.encode(), 6)
 
 
-def write_protein_ids(protein2id, organism):
-    """ Replaces the accession numbers in direct hit files by their
-    corresponding ID in the protein table. This happens per organism,
-    all file names which have '_direct_' and the organism name in it
-    will be replaced. Those files, are later used to insert directly
-    in the database.
+def decode_msa(msa, msa_zlib):
+    """ Retrieves a multiple sequence alignment from a row of the
+    multiplesequencealignment table, whether it is stored as text in
+    the msa column or compressed in the msa_zlib column.
 
     Parameters:
-        protein2id (dictionary): The dictionary which has keys as names
-            (practically only the accession) and values as numeric ID's.
-        organism (string): The name of the organism.
+        msa (string): The value of the msa column.
+        msa_zlib (bytes or memoryview): The value of the msa_zlib
+            column.
     Returns:
-        -
+        1. String: The complete multiple sequence alignment.
     """
-    for file in os.listdir(os.getcwd()):
-        if organism in file and "_direct_" in file:
-            replace_side = int(file.split("_direct_")[1] == organism)
-            with open(file) as infile:
-                with open(file + ".tmp", "w") as outfile:
-                    for line in infile:
-                        prots = line.strip().split(";")
-                        prots[replace_side] = protein2id[prots[replace_side]]
-                        outfile.write(";".join(prots) + "\n")
-            os.remove(file)
-            os.rename(file + ".tmp", file)
+    if msa is not None:
+        return msa
+    return zlib.decompress(bytes(msa_zlib)).decode()
 
 
-def fill_protein_table(cursor, organism, org_id, prot_id):
-    """ Fills the protein table one organism at a time. This will
-    collect the full name (only the '>' is stripped off) and
-    corresponding sequence. After the inserts are complete, the
-    'write_protein_ids' function is called.
+def multiple_sequence_alignment(name_sequence_tuple, cog, timeout=None,
+                                aligner=None):
+    """ A function which executes a multiple sequence alignment of the
+    proteins of a cog with the given aligner.
 
     Parameters:
-        cursor (psycopg2 cursor class): The cursor to execute queries
-            with.
-        organism (string): The name of the organism.
-        org_id (int): The database ID of the organism.
-        prot_id (int): The next ID of a protein.
+        name_sequence_tuple (list): A list of tuples which contain the
+            name of the sequence (0) and the sequence itself (1).
+        cog (int): The cog ID.
+        timeout (int): The amount of seconds the aligner may take, or
+            None to wait until it finishes.
+        aligner (object): One of the aligners in _ALIGNERS, defaults to
+            ClustalW.
     Returns:
-        1. Int: A new protein ID for the next protein.
+        1. Int: the cog ID.
+        2. String: the complete multiple sequence alignment, or None
+        when the aligner took longer than the timeout.
     """
-    protein2id = dict()
-    last_prot = ""
-    last_seq = ""
-    with open(organism + ".fa") as infile:
-        for line in infile:
-            if line[0] == ">":
-                prot_id = insert_protein(cursor, prot_id, org_id, last_prot,
-                                         last_seq, protein2id)
-                last_prot = line[1:].strip()
-                last_seq = ""
-            else:
-                last_seq += line.strip()
-    prot_id = insert_protein(cursor, prot_id, org_id, last_prot, last_seq,
-                             protein2id)
-    write_protein_ids(protein2id, organism)
-    return prot_id
+    if aligner is None:
+        aligner = _ALIGNERS["clustalw"]
+    try:
+        return cog, aligner.align(name_sequence_tuple, timeout)
+    except subprocess.TimeoutExpired:
+        _METRICS.count("alignments_timed_out")
+        print("Aligning cog {} took longer than {} seconds, skipped"
+              .format(cog, timeout), file=sys.stderr)
+        return cog, None
 
 
-def fill_bidirectional_hits(connection, cursor):
-    """ Fills the directionalhit table using all the *_direct_* files
-    inserted into a temporary table. Then a query is executed to get
-    all bidirectional hits and the temporary table will be removed.
+def read_cog_members(connection, cogs=None, proteomes=None):
+    """ Reads the names and sequences of the proteins in the cogs, one
+    cog at a time, using a server-side cursor so only a part of the
+    proteins is in memory at once. The cogs which are expected to take
+    the longest to align (the amount of proteins times the length of
+    the longest sequence) come first. The cursor is kept open over
+    commits. When proteomes are given, only the names are read from
+    the database and the sequences are read from the fasta files of
+    the organisms with 'FastaIndex', which is opened the first time a
+    protein of the organism is read.
 
     Parameters:
         connection (psycopg2 connection class): The connection with the
             database.
-        cursor (psycopg2 cursor class): The cursor to execute queries
-            with.
+        cogs (list of ints): The cogs to read, or None to read all
+            cogs.
+        proteomes (dictionary): Is filled with organism names as keys
+            and the FastaIndex of their fasta file as values, or None to
+            read the sequences from the database.
     Returns:
-        -
+        1. Generator: yields tuples with the cog ID (0) and a list of
+        tuples which contain the name (0) and sequence (1) of each
+        protein in the cog (1).
     """
-    os.system("cat *_direct_* > total")
-    with open("total") as infile:
-        cursor.copy_from(infile, "temporaryhit", sep=";",
-                         columns=("protein_a", "protein_b"))
-    connection.commit()
-    os.remove("total")
-    cursor.execute("""
-        INSERT INTO directionalhit (protein_a, protein_b)
-        SELECT protein_a, protein_b FROM (
-          SELECT a.protein_a, a.protein_b
-          FROM temporaryhit a
-            INNER JOIN temporaryhit b
-              ON a.protein_a = b.protein_b AND a.protein_b = b.protein_a
-        ) AS combination_set
-        WHERE protein_a < protein_b""")
-    cursor.execute("DROP TABLE temporaryhit CASCADE")
-    connection.commit()
+    cursor = connection.cursor(name="cog_members", withhold=True)
+    try:
+        cursor.execute("""
+            SELECT protein.cog, protein.name, {}
+            FROM protein
+              INNER JOIN organism ON organism.organism_id = protein.organism
+              INNER JOIN (
+                SELECT cog, COUNT(*) * MAX(LENGTH(sequence)) AS cost
+                FROM protein
+                WHERE {}
+                GROUP BY cog
+              ) AS cog_cost ON cog_cost.cog = protein.cog
+            ORDER BY cog_cost.cost DESC, protein.cog ASC""".format(
+            "sequence" if proteomes is None else "organism.name",
+            "cog IS NOT NULL" if cogs is None else "cog = ANY(%s)"),
+            None if cogs is None else (cogs,))
+        for cog, rows in itertools.groupby(cursor, key=lambda row: row[0]):
+            if proteomes is None:
+                yield cog, [(name, sequence) for _, name, sequence in rows]
+                continue
+            members = []
+            for _, name, organism in rows:
+                if organism not in proteomes:
+                    proteomes[organism] = FastaIndex(organism + ".fa")
+                members.append((name, proteomes[organism].sequence(
+                    name.split()[0])))
+            yield cog, members
+    finally:
+        cursor.close()
 
 
-def fill_database(connection, cursor, organisms):
-    """ The main function which fills the database tables except for
-    the cog and multiplesequencealignment tables. The tables are filled
-    in the following order:
-      1. organism table
-      2. protein table
-      3. directionalhit table
+def align_cogs(cog_members, workers, timeout=None, aligner=None):
+    """ Aligns cogs with 'multiple_sequence_alignment', with 'workers'
+    alignments running at the same time. The cogs are only taken from
+    cog_members when a worker is about to become free, and every
+    alignment is given back as soon as it is finished.
 
     Parameters:
-        connection (psycopg2 connection class): The connection with the
-            database.
-        cursor (psycopg2 cursor class): The cursor to execute queries
-            with.
-        organisms (list of string): The organisms which are used in
-            this COG program.
+        cog_members (iterable): Tuples with the cog ID (0) and the
+            names and sequences of its proteins (1), as given by
+            'read_cog_members'.
+        workers (int): The amount of alignments running at the same
+            time.
+        timeout (int): The amount of seconds a single alignment may
+            take, or None to wait until it finishes.
+        aligner (object): One of the aligners in _ALIGNERS, defaults to
+            ClustalW.
     Returns:
-        -
+        1. Generator: yields tuples with the cog ID (0) and the complete
+        multiple sequence alignment (1), in the order they finish.
+        Alignments which took longer than the timeout are left out.
     """
-    bulk_insert = []
-    for organism in organisms:
-        bulk_insert.append(
-            "INSERT INTO organism (name) VALUES ('{}')".format(organism))
-    cursor.execute(";".join(bulk_insert))
-    connection.commit()
-    current_id = 1
-    for organism in organisms:
-        current_id = fill_protein_table(
-            cursor, organism, organisms.index(organism) + 1, current_id)
-    fill_bidirectional_hits(connection, cursor)
+    pool = ThreadPool(workers)
+    finished = queue.Queue()
+    pending = 0
+    cog_members = iter(cog_members)
+    try:
+        while True:
+            while pending < 2 * workers:
+                cog, name_sequence_tuple = next(cog_members, (None, None))
+                if cog is None:
+                    break
+                pool.apply_async(multiple_sequence_alignment,
+                                 (name_sequence_tuple, cog, timeout,
+                                  aligner),
+                                 callback=finished.put,
+                                 error_callback=finished.put)
+                pending += 1
+            if not pending:
+                break
+            result = finished.get()
+            pending -= 1
+            if isinstance(result, BaseException):
+                raise result
+            if result[1] is not None:
+                yield result
+    except BaseException:
+        stop_processes(pool)
+        raise
+    finally:
+        pool.terminate()
 
 
-def remove_twogs(twogs, remove_containing):
-    """ Removes twogs which contain a protein ID specified in the list
-    of remove_containing. This method does NOT rewrite the twogs file.
+def do_multiple_sequence_alignments(cursor, cogs=None):
+    """ The main function which can execute multiple sequence
+    alignments by calling 'multiple_sequence_alignment'. This can be
+    done in parallel (to increase the speed of the runtime) by adding
+    '--msa-threads <int>' on the command line by replacing '<int>' by
+    a positive integer greater than 0. The cogs which are expected to
+    take the longest are aligned first, so no large cog is left running
+    on its own at the end. A single alignment can be limited with
+    '--msa-timeout <seconds>'; cogs which take longer get no alignment.
+    The proteins are read per cog and the alignments are inserted in
+    the database as they finish, in batches of _MSA_BATCH_SIZE which
+    are committed right away, so the memory use does not depend on the
+    amount of cogs. Earlier alignments of the cogs are replaced. With
+    '--compress-msa' the alignments are stored compressed. The aligner
+    is chosen with '--aligner <name>', see 'get_aligner'. When the fasta
+    files of all organisms are present, the sequences are read from
+    them instead of from the database.
 
     Parameters:
-        twogs (list): A list of tuples which contain a bidirectional
-            hit using protein ID's.
-        remove_containing (list of ints): A list of protein ID's.
+        cursor (psycopg2 cursor class): The cursor to execute queries
+            with.
+        cogs (list of ints): The cogs to align, or None to align all
+            cogs.
     Returns:
         -
     """
-    remove_indices = []
-    for index in range(len(twogs)):
-        for remove_this in remove_containing:
-            if remove_this in twogs[index]:
-                remove_indices.append(index)
-                break
-    remove_indices.sort(reverse=True)
-    for index in remove_indices:
-        del twogs[index]
+    connection = cursor.connection
+    if cogs is None:
+        cursor.execute("DELETE FROM multiplesequencealignment")
+    else:
+        cursor.execute("""
+            DELETE FROM multiplesequencealignment
+            WHERE cog = ANY(%s)""", (cogs,))
+    cursor.execute("SELECT name FROM organism")
+    if all(os.path.exists(name + ".fa") for name, in cursor.fetchall()):
+        proteomes = dict()
+    else:
+        proteomes = None
+    connection.commit()
+    compress = "--compress-msa" in sys.argv
+    msa_vars = []
+    try:
+        for cog, msa in align_cogs(read_cog_members(connection, cogs,
+                                                    proteomes),
+                                   get_int_argument("--msa-threads", 1),
+                                   get_int_argument("--msa-timeout", None),
+                                   get_aligner()):
+            msa_vars.append((cog, msa))
+            _METRICS.count("alignments")
+            if len(msa_vars) >= _MSA_BATCH_SIZE:
+                insert_alignments(cursor, msa_vars, compress)
+                msa_vars = []
+        insert_alignments(cursor, msa_vars, compress)
+    finally:
+        for proteome in (proteomes or dict()).values():
+            proteome.close()
 
 
-def write_read_twogs(twogs=None, mode="w", organism_id1=-1, organism_id2=-1):
-    """ This method will always write the given twogs to a file called
-    "twogs" with the specified mode. When twogs are not available, the
-    organism_id1 and organism_id2 must be available to read the twogs
-    from a file called "full_twogs". This reading involves only
-    reading the twogs which are known from given organism ID's.
+def insert_alignments(cursor, msa_vars, compress=False):
+    """ Inserts multiple sequence alignments in the database and
+    commits them.
 
     Parameters:
-        twogs (list): A list of tuples containing bidirectional hits.
-        mode (string): The mode to write to the "twogs" file. Only "a"
-            and "w" are permitted.
-        organism_id1 (int): The organism ID of organism 1.
-        organism_id2 (int): The organism ID of organism 2.
+        cursor (psycopg2 cursor class): The cursor to execute queries
+            with.
+        msa_vars (list): A list of tuples with the cog ID (0) and the
+            complete multiple sequence alignment (1).
+        compress (boolean): Whether to store the alignments compressed
+            in the msa_zlib column instead of the msa column.
     Returns:
         -
     """
-    if twogs is None:
-        twogs = []
-        organism_code_tuple = (organism_id1, organism_id2)
-        with open("full_twogs") as infile:
-            for line in infile:
-                org_prot1, org_prot2, org_id1, org_id2 = tuple(map(
-                    int, line.strip().split(";")))
-                if ((org_id1, org_id2) == organism_code_tuple
-                    or (org_id2, org_id1) == organism_code_tuple):
-                        twogs.append((org_prot1, org_prot2))
-    with open("twogs", mode) as outfile:
-        for twog in twogs:
-            outfile.write(";".join(map(str, twog)) + "\n")
+    if msa_vars and compress:
+        binary = bytes if is_embedded(cursor.connection) else psycopg2.Binary
+        cursor.executemany("INSERT INTO multiplesequencealignment " +
+                           "(cog, msa_zlib) VALUES (%s, %s)",
+                           [(cog, binary(compress_msa(msa)))
+                            for cog, msa in msa_vars])
+    elif msa_vars:
+        cursor.executemany("INSERT INTO multiplesequencealignment " +
+                           "(cog, msa) VALUES (%s, %s)", msa_vars)
+    cursor.connection.commit()
 
 
-def get_cog_proteins(cursor):
-    """ Retrieves the cog number along with the protein ID's contained
-    in it.
+def get_cog_sizes(cursor):
+    """ Retrieves the amount of proteins in each cog.
 
     Parameters:
         cursor (psycopg2 cursor class): The cursor to execute queries
             with.
     Returns:
-        1. Dict: A dictionary with keys as cog ID and as
-        values a list of protein ID's.
+        1. Dict: A dictionary with keys as cog ID and as values the
+        amount of proteins in that cog.
     """
     cursor.execute("""
-        SELECT cog, protein_id
+        SELECT cog, COUNT(*)
         FROM protein
         WHERE cog IS NOT NULL
-        ORDER BY cog ASC""")
-    cog_map = OrderedDict()
-    for cog, protein_id in cursor.fetchall():
-        if cog not in cog_map:
-            cog_map[cog] = []
-        cog_map[cog].append(protein_id)
-    return cog_map
+        GROUP BY cog""")
+    return dict(cursor.fetchall())
 
 
-def update_cogs(cursor, twogs):
-    """ Finds per cog a best matching protein and adds it to that cog.
+def add_organisms(connection, cursor, organisms, manifest=None):
+    """ Adds the organisms which are not yet in the database, without
+    rebuilding the database. The organisms in the database must be the
+    first organisms in the given list. Only the new organisms are
+    BLASTed against all other organisms (in both directions), only
+    their proteins and bidirectional hits are loaded and the cogs are
+    only found for the new organisms. Finally only the cogs which got
+    new proteins are aligned again.
 
     Parameters:
+        connection (psycopg2 connection class): The connection with the
+            database.
         cursor (psycopg2 cursor class): The cursor to execute queries
             with.
-        twogs (list): A list of tuples containing bidirectional hits.
+        organisms (list of string): The organisms which are used in
+            this COG program.
+        manifest (Manifest): Remembers which databases and pairs are
+            already made.
     Returns:
-        1. List: A list of integers which represent protein ID's
-        which should not be used in the 'new_cogs' function.
+        -
     """
-    cog_map = get_cog_proteins(cursor)
-    skip_proteins = []
-    delete_twogs = []
-    for cog in cog_map:
-        cog_proteins = cog_map[cog]
-        protein_counter = Counter()
-        for twog in twogs:
-            for cog_protein in cog_proteins:
-                if cog_protein in twog:
-                    index = int(twog[1] != cog_protein)
-                    protein_counter.update(twog[index:index + 1])
-                    delete_twogs.append(cog_protein)
-        if len(protein_counter):
-            common_protein = protein_counter.most_common(1)[0][0]
-            cursor.execute("UPDATE protein SET cog = %s " +
-                           "WHERE protein_id = %s", (cog, common_protein))
-            remove_twogs(twogs, delete_twogs + [common_protein])
-            delete_twogs.clear()
-            skip_proteins.append(common_protein)
-    return skip_proteins
+    cursor.execute("SELECT name FROM organism ORDER BY organism_id ASC")
+    existing = [name for name, in cursor.fetchall()]
+    if organisms[:len(existing)] != existing:
+        raise Exception("The organisms in the database must be the first "
+                        "organisms in Project_files/Organismen.txt!")
+    new_organisms = organisms[len(existing):]
+    if not new_organisms:
+        return
+    cursor.execute("SELECT COALESCE(MAX(protein_id), 0) + 1 FROM protein")
+    prot_id = cursor.fetchone()[0]
+    protein_ids = read_database_protein_ids(cursor, existing)
+    protein_ids.update(read_protein_ids(new_organisms, prot_id))
+    with _METRICS.stage("blast_organisms"):
+        blast_organisms(organisms, new_organisms, protein_ids, manifest)
+    for organism in new_organisms:
+        cursor.execute("INSERT INTO organism (organism_id, name) " +
+                       "VALUES (%s, %s)",
+                       (organisms.index(organism) + 1, organism))
+    if not is_embedded(connection):
+        cursor.execute("""
+            SELECT setval(pg_get_serial_sequence('organism', 'organism_id'),
+                          MAX(organism_id))
+            FROM organism""")
+    for organism in new_organisms:
+        with _METRICS.stage("fill_protein_table", organism):
+            prot_id = fill_protein_table(cursor, organism,
+                                         organisms.index(organism) + 1,
+                                         prot_id)
+    with _METRICS.stage("fill_bidirectional_hits"):
+        fill_bidirectional_hits_in_process(connection, cursor, organisms,
+                                           new_organisms)
+    cog_sizes = get_cog_sizes(cursor)
+    with _METRICS.stage("find_cogs"):
+        analyze_tables(connection, cursor)
+        find_cogs(connection, cursor, organisms, len(existing))
+    with _METRICS.stage("do_multiple_sequence_alignments"):
+        do_multiple_sequence_alignments(cursor, [
+            cog for cog, size in get_cog_sizes(cursor).items()
+            if cog_sizes.get(cog) != size])
 
 
-def read_organism_proteins(organism_id, skip_proteins):
-    """ Retrieves a set of protein ID's which belong to the given
-    organism ID. This reduces the amount of loops which 'new_cogs'
-    has to do. Proteins which are not in the bidirectionalhits will
-    never be participating in a COG.
+def msa_keys(manifest, organisms, key):
+    """ Creates the keys of the multiple sequence alignment stage,
+    which also depends on the settings of the alignments.
 
     Parameters:
-        organism_id (int): The database ID of the organism.
-        skip_proteins (list of ints): A list of integers which should
-            are already in cogs according to the function 'update_cogs'.
+        manifest (Manifest): Remembers which stages are completed.
+        organisms (list of string): The organisms which are used in
+            this COG program.
+        key (string): The key of the inputs of the earlier stages, as
+            given by 'Manifest.input_key'.
     Returns:
-        1. Set: A set of protein ID's which are used in 'new_cogs'.
+        1. String: The key of the settings which change the alignments
+        themselves: the aligner and whether they are compressed. The
+        organisms are left out, as the alignments of changed cogs are
+        already removed (or replaced by '--incremental').
+        2. String: The key of the stage, which also contains the
+        inputs of the earlier stages and the timeout of a single
+        alignment.
     """
-    proteins = set()
-    with open("full_twogs") as infile:
-        for line in infile:
-            prot1, prot2, id1, id2 = tuple(map(int, line.strip().split(";")))
-            if id1 == organism_id and prot1 not in skip_proteins:
-                proteins.add(prot1)
-            if id2 == organism_id and prot2 not in skip_proteins:
-                proteins.add(prot2)
-    return proteins
+    results_key = manifest.input_key([], get_argument(
+        "--aligner", "clustalw"), "--compress-msa" in sys.argv)
+    return results_key, manifest.input_key(
+        organisms, key, results_key, get_int_argument("--msa-timeout", None))
 
 
-def new_cogs(cursor, twogs, organism_id, skip_proteins):
-    """ Finds new cogs. A new cog is defined as 3 proteins which have
-    bidirectional hits with each other:
-        A - B
-         \ /
-          C
+def get_unaligned_cogs(cursor):
+    """ Retrieves the cogs which have no multiple sequence alignment.
+
+    Parameters:
+        cursor (psycopg2 cursor class): The cursor to execute queries
+            with.
+    Returns:
+        1. List of ints: The cog ID's.
+    """
+    cursor.execute("""
+        SELECT cog_id
+        FROM cog
+        WHERE cog_id NOT IN (
+          SELECT cog FROM multiplesequencealignment
+          WHERE cog IS NOT NULL)""")
+    return [cog for cog, in cursor.fetchall()]
+
+
+def complete_alignments(connection, cursor, manifest, keys):
+    """ Aligns the cogs which have no multiple sequence alignment yet.
+    When the aligner or the compression changed since the alignments
+    were made, all alignments are made again. The stage is only
+    completed when every cog has an alignment, so cogs which took
+    longer than the timeout are tried again in the next run.
 
     Parameters:
+        connection (psycopg2 connection class): The connection with the
+            database.
         cursor (psycopg2 cursor class): The cursor to execute queries
             with.
-        twogs (list): A list of tuples containing bidirectional hits.
-        organism_id (int): The database ID of the organism.
-        skip_proteins (list of ints): A list of integers which should
-            are already in cogs according to the function 'update_cogs'
+        manifest (Manifest): Remembers which stages are completed.
+        keys (tuple of strings): The keys as given by 'msa_keys'.
     Returns:
         -
     """
-    cursor.execute("SELECT MAX(cog_id) FROM cog")
-    cog_id = (cursor.fetchone()[0] or 0) + 1
-    for protein_id in read_organism_proteins(organism_id, skip_proteins):
-        found_twogs = []
-        for twog in twogs:
-            if protein_id in twog:
-                found_twogs.append(twog[int(twog[1] != protein_id)])
-        hidden_twogs = set()
-        for found_twogs_index in range(len(found_twogs)):
-            for combine_with in found_twogs[found_twogs_index + 1:]:
-                twog_combo = (found_twogs[found_twogs_index], combine_with)
-                if twog_combo in twogs or twog_combo[::-1] in twogs:
-                    hidden_twogs.update([*twog_combo, protein_id])
-        if len(hidden_twogs):
-            cursor.execute("INSERT INTO cog (cog_id) VALUES (%s)", (cog_id,))
-            cursor.execute("UPDATE protein SET cog = %s WHERE protein_id IN "
-                           + str(tuple(hidden_twogs)), (cog_id,))
-            remove_twogs(twogs, hidden_twogs)
-            cog_id += 1
-
-
-def find_cogs(connection, cursor, organisms):
-    """ The main algorithm to find and update cogs. First it will dump
-    all bidirectional hits from the database in a file called
-    "full_twogs" along with the organism ID's of those proteins.
-    Then it will read the twogs of two organisms and when the more or
-    equal than 3 organism are contained in the twogs, the following
-    sequence will happen:
-      1. Read the twogs from the twogs file
-      2. Call update_cogs
-      3. Call new_cogs
-      4. Write the twogs to remove the removed twogs completely.
+    results_key, key = keys
+    if not manifest.start_stage("msa", results_key):
+        cursor.execute("DELETE FROM multiplesequencealignment")
+        connection.commit()
+    cogs = get_unaligned_cogs(cursor)
+    if cogs:
+        with _METRICS.stage("do_multiple_sequence_alignments"):
+            do_multiple_sequence_alignments(cursor, cogs)
+        connection.commit()
+    if not get_unaligned_cogs(cursor):
+        manifest.complete_stage("msa", key)
+
+
+def resume_pipeline(connection, cursor, organisms, manifest, key,
+                    alignment_keys):
+    """ Runs the stages after BLAST which are not completed yet with
+    the current inputs: loading the database, finding the cogs and the
+    multiple sequence alignments. A stage which did not complete is
+    started over, so the results of a crashed run are thrown away
+    first. Only the multiple sequence alignments are kept, as those
+    are committed while they are made: only the cogs without an
+    alignment are aligned (see 'complete_alignments').
 
     Parameters:
         connection (psycopg2 connection class): The connection with the
@@ -434,133 +2981,87 @@ def find_cogs(connection, cursor, organisms):
             with.
         organisms (list of string): The organisms which are used in
             this COG program.
+        manifest (Manifest): Remembers which stages are completed.
+        key (string): The key of the inputs as given by
+            'Manifest.input_key'.
+        alignment_keys (tuple of strings): The keys of the multiple
+            sequence alignment stage as given by 'msa_keys'.
     Returns:
         -
     """
-    if os.path.exists("twogs"):
-        os.remove("twogs")
-    cursor.execute("""SELECT protein_a, protein_b, a.organism, b.organism
-                      FROM directionalhit
-                        INNER JOIN protein a ON a.protein_id = protein_a
-                        INNER JOIN protein b ON b.protein_id = protein_b""")
-    with open("full_twogs", "w") as outfile:
-        for line_data in cursor:
-            outfile.write(";".join(map(str, line_data)) + "\n")
-    for organism1_id in range(len(organisms)):
-        for organism2_id in range(len(organisms)):
-            if organism1_id > organism2_id:
-                write_read_twogs(mode="a", organism_id1=organism1_id + 1,
-                                 organism_id2=organism2_id + 1)
-        if organism1_id > 1:
-            twogs = []
-            with open("twogs") as infile:
-                for line in infile:
-                    twogs.append(tuple(map(int, line.strip().split(";"))))
-            new_cogs(cursor, twogs, organism1_id + 1,
-                     update_cogs(cursor, twogs))
-            write_read_twogs(twogs=twogs, mode="w")
-            connection.commit()
+    if not manifest.stage_done("load", key):
+        with open(sql_file(connection, "create_tables.sql")) as sql:
+            cursor.execute(sql.read())
+        connection.commit()
+        with _METRICS.stage("fill_database"):
+            fill_database(connection, cursor, organisms)
+            add_constraints(connection, cursor)
+        connection.commit()
+        manifest.complete_stage("load", key)
+    if not manifest.stage_done("cogs", key):
+        cursor.execute("DELETE FROM multiplesequencealignment")
+        cursor.execute("UPDATE protein SET cog = NULL")
+        cursor.execute("DELETE FROM cog")
+        with _METRICS.stage("find_cogs"):
+            analyze_tables(connection, cursor)
+            find_cogs(connection, cursor, organisms)
+        connection.commit()
+        manifest.complete_stage("cogs", key)
+    if not manifest.stage_done("msa", alignment_keys[1]):
+        complete_alignments(connection, cursor, manifest, alignment_keys)
 
 
-def get_msa(file):
-    """ Parses an alignment file to fit the complete alignment in a
-    string instead of a file.
+def export_value(value):
+    """ Writes a value of the embedded database in the text format of
+    COPY.
 
     Parameters:
-        file (string): The name of the file to parse
+        value (int, string, bytes or None): The value.
     Returns:
-        1. String: the complete multiple sequence alignment
+        1. String: The escaped value.
     """
-    msa = OrderedDict()
-    skip_line = True
-    start_index = None
-    with open(file) as infile:
-        for line in infile:
-            if skip_line:
-                skip_line = False
-                continue
-            if len(line) > 1:
-                lines = line.split()
-                if len(lines) == 2:
-                    if lines[0] not in msa:
-                        msa[lines[0]] = ""
-                    msa[lines[0]] += lines[1]
-                    start_index = line.find(lines[1])
-                else:
-                    if "consensus" not in msa:
-                        msa["consensus"] = ""
-                    msa["consensus"] += line[start_index:-1]
-    msa_text = ""
-    for accession, sequence in msa.items():
-        msa_text += '{}{}{}\n'.format(
-            accession, " " * (start_index - len(accession)), sequence)
-    return msa_text
-
-
-def multiple_sequence_alignment(name_sequence_tuple, cog):
-    """ A function which executes a multiple sequence alignment. First
-    the sequence will be written to a file which then can be used by
-    ClustalW. When ClustalW ran, the function 'get_msa' will parse the
-    alignment file.
+    if value is None:
+        return "\\N"
+    if isinstance(value, bytes):
+        return "\\\\x" + value.hex()
+    return copy_escape(str(value))
 
-    Parameters:
-        name_sequence_tuple (list): A list of tuples which contain the
-            name of the sequence (0) and the sequence itself (1).
-        cog (int): The cog ID.
-    Returns:
-        1. Int: the cog ID.
-        2. String: the complete multiple sequence alignment.
-    """
-    files = "msa_file{c}.fa tree_file{c}.dnd output{c}.aln".format(
-        c=cog).split()
-    with open(files[0], "w") as outfile:
-        for name, sequence in name_sequence_tuple:
-            outfile.write(">" + name + "\n")
-            for i in range(0, len(sequence), 80):
-                outfile.write(sequence[i:i + 80] + "\n")
-    os.system("clustalw -infile={} -newtree={} -outfile={} -align -quiet"
-              .format(*files))
-    msa_string = get_msa(files[2])
-    for file in files:
-        os.remove(file)
-    return cog, msa_string
-
-
-def do_multiple_sequence_alignments(cursor):
-    """ The main function which can execute multiple sequence
-    alignments by calling 'multiple_sequence_alignment'. This can be
-    done in parallel (to increase the speed of the runtime) by adding
-    '--msa-threads <int>' on the command line by replacing '<int>' by
-    a positive integer greater than 0.
-    The multiple sequence alignments from a cog are finally inserted in
-    the database.
+
+def export_database(connection, target):
+    """ Copies all tables of an embedded database to a PostgreSQL
+    database, which is emptied with create_tables.sql first. Every
+    table is streamed with a single COPY in the order of its ID's,
+    after which the keys and indexes are added and the sequences of
+    the ID's continue after the highest ID, so the result is the same
+    as when the pipeline had used the PostgreSQL database.
 
     Parameters:
-        cursor (psycopg2 cursor class): The cursor to execute queries
-            with.
+        connection (EmbeddedConnection): The connection with the
+            embedded database.
+        target (psycopg2 connection class): The connection with the
+            PostgreSQL database.
     Returns:
         -
     """
-    arguments = dict()
-    cursor.execute("""
-        SELECT name, sequence, cog
-        FROM protein
-        WHERE cog IS NOT NULL
-        ORDER BY cog ASC""")
-    for name, sequence, cog in cursor:
-        if cog not in arguments:
-            arguments[cog] = ([], cog)
-        arguments[cog][0].append((name, sequence))
-    msa_threads = 1
-    if '--msa-threads' in sys.argv:
-        index = sys.argv.index('--msa-threads')
-        if (index + 1 < len(sys.argv) and
-                sys.argv[index + 1].strip().isnumeric()):
-            msa_threads = max(1, int(sys.argv[index + 1].strip()))
-    pool = ThreadPool(msa_threads)
-    msa_vars = pool.starmap(multiple_sequence_alignment, arguments.values())
-    cursor.executemany("INSERT INTO multiplesequencealignment (cog, msa) " +
-                       "VALUES (%s, %s)", msa_vars)
+    cursor = connection.cursor()
+    target_cursor = target.cursor()
+    with open(sql_file(target, "create_tables.sql")) as sql:
+        target_cursor.execute(sql.read())
+    target_cursor.execute("DROP TABLE temporaryhit")
+    for table, columns in _EXPORT_TABLES:
+        cursor.execute("SELECT {} FROM {} ORDER BY {} ASC".format(
+            ", ".join(columns), table, columns[0]))
+        target_cursor.copy_from(CopyFile(
+            "\t".join([export_value(value) for value in row]) + "\n"
+            for row in cursor), table, columns=columns)
+        target_cursor.execute("""
+            SELECT setval(pg_get_serial_sequence('{0}', '{1}'), MAX({1}))
+            FROM {0}""".format(table, columns[0]))
+    target.commit()
+    add_constraints(target, target_cursor)
+    analyze_tables(target, target_cursor)
+    target_cursor.close()
+    cursor.close()
 
 
 def main():
@@ -568,18 +3069,65 @@ def main():
         raise Exception("Project_files/Organismen.txt does not exist!")
     with open("Project_files/Organismen.txt") as f:
         organism_list = [organism.strip() for organism in f]
+    report_files = [os.path.abspath(get_argument(argument, None))
+                    for argument in ("--metrics", "--profile")
+                    if get_argument(argument, None) is not None]
+    _METRICS.profile = get_argument("--profile", None) is not None
     os.chdir("Project_files")
-    blast_organisms(organism_list)
-    connection = psycopg2.connect(host="localhost", dbname="postgres",
-                                  user="postgres", password="Password")
+    try:
+        run_pipeline(organism_list)
+    finally:
+        for line in _METRICS.summary():
+            print(line, file=sys.stderr)
+        for report_file in report_files:
+            write_result_file(report_file, [json.dumps(
+                _METRICS.report(), indent=1)])
+
+
+def run_pipeline(organism_list):
+    """ Runs the whole pipeline, or only adds the new organisms with
+    '--incremental', in the Project_files directory.
+
+    Parameters:
+        organism_list (list of strings): The organisms which are used
+            in this COG program.
+    Returns:
+        -
+    """
+    incremental = "--incremental" in sys.argv
+    storage = get_storage()
+    if incremental and storage == "memory":
+        raise Exception("--incremental needs a database which is kept "
+                        "between runs!")
+    manifest = Manifest(enabled="--no-cache" not in sys.argv)
+    key = manifest.input_key(organism_list, get_search().key, [
+        argument for argument in ("--stream-hits", "--in-process-hits")
+        if argument in sys.argv], storage_key(storage))
+    alignment_keys = msa_keys(manifest, organism_list, key)
+    if storage == "memory":
+        # A database in memory is empty at the start of every run.
+        manifest.forget_stages("load")
+    if not incremental and not manifest.stage_done("load", key):
+        with _METRICS.stage("blast_organisms"):
+            blast_organisms(organism_list, manifest=manifest)
+        manifest.complete_stage("blast", key)
+    connection = connect_database(storage)
     cursor = connection.cursor()
-    with open("../create_tables.sql") as sql:
-        cursor.execute(sql.read())
-    connection.commit()
-    fill_database(connection, cursor, organism_list)
-    find_cogs(connection, cursor, organism_list)
-    do_multiple_sequence_alignments(cursor)
-    connection.commit()
+    if incremental:
+        with _METRICS.stage("add_organisms"):
+            add_organisms(connection, cursor, organism_list, manifest)
+        connection.commit()
+        for stage in _STAGES[:-1]:
+            manifest.complete_stage(stage, key)
+        complete_alignments(connection, cursor, manifest, alignment_keys)
+    else:
+        resume_pipeline(connection, cursor, organism_list, manifest, key,
+                        alignment_keys)
+    if "--export-postgres" in sys.argv and storage != "postgres":
+        with _METRICS.stage("export_database"):
+            target = connect_database()
+            export_database(connection, target)
+            target.close()
     cursor.close()
     connection.close()
 
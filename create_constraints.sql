@@ -0,0 +1,17 @@
+-- Run after the protein and directionalhit tables are loaded, so the
+-- bulk load does not have to check keys and update indexes per row.
+ALTER TABLE protein
+  ADD CONSTRAINT protein_idpk PRIMARY KEY(protein_id),
+  ADD CONSTRAINT organism_fk FOREIGN KEY(organism) REFERENCES organism(organism_id),
+  ADD CONSTRAINT cog_fk FOREIGN KEY(cog) REFERENCES cog(cog_id);
+
+ALTER TABLE directionalhit
+  ADD CONSTRAINT hit_idpk PRIMARY KEY(hit_id),
+  ADD CONSTRAINT protein_afk FOREIGN KEY(protein_a) REFERENCES protein(protein_id),
+  ADD CONSTRAINT protein_bfk FOREIGN KEY(protein_b) REFERENCES protein(protein_id);
+
+CREATE INDEX protein_cog_idx ON protein(cog);
+CREATE INDEX protein_organism_idx ON protein(organism);
+CREATE INDEX directionalhit_proteins_idx ON directionalhit(protein_a, protein_b);
+CREATE INDEX protein_accession_idx ON protein(split_part(name, ' ', 1));
+CREATE INDEX msa_cog_idx ON multiplesequencealignment(cog);
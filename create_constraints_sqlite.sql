@@ -0,0 +1,8 @@
+-- The indexes of create_constraints.sql for the embedded SQLite
+-- database. The keys are already part of create_tables_sqlite.sql, as
+-- SQLite cannot add them to an existing table.
+CREATE INDEX protein_cog_idx ON protein(cog);
+CREATE INDEX protein_organism_idx ON protein(organism);
+CREATE INDEX directionalhit_proteins_idx ON directionalhit(protein_a, protein_b);
+CREATE INDEX protein_accession_idx ON protein(split_part(name, ' ', 1));
+CREATE INDEX msa_cog_idx ON multiplesequencealignment(cog);
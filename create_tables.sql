@@ -1,3 +1,5 @@
+-- The keys and indexes of the protein and directionalhit tables are
+-- added by create_constraints.sql once the data is loaded.
 DROP TABLE IF EXISTS organism CASCADE;
 CREATE TABLE organism
   (
@@ -20,14 +22,11 @@ CREATE TABLE protein
      name       TEXT NOT NULL,
      sequence   TEXT NOT NULL,
      organism   INTEGER NOT NULL,
-     cog        INTEGER,
-     CONSTRAINT protein_idpk PRIMARY KEY(protein_id),
-     CONSTRAINT organism_fk FOREIGN KEY(organism) REFERENCES organism(organism_id),
-     CONSTRAINT cog_fk FOREIGN KEY(cog) REFERENCES cog(cog_id)
+     cog        INTEGER
   );
 
 DROP TABLE IF EXISTS temporaryhit CASCADE;
-CREATE TABLE temporaryhit
+CREATE UNLOGGED TABLE temporaryhit
   (
       protein_a INTEGER NOT NULL,
       protein_b INTEGER NOT NULL
@@ -38,18 +37,17 @@ CREATE TABLE directionalhit
   (
      hit_id    SERIAL NOT NULL,
      protein_a INTEGER NOT NULL,
-     protein_b INTEGER NOT NULL,
-     CONSTRAINT hit_idpk PRIMARY KEY(hit_id),
-     CONSTRAINT protein_afk FOREIGN KEY(protein_a) REFERENCES protein(protein_id),
-     CONSTRAINT protein_bfk FOREIGN KEY(protein_b) REFERENCES protein(protein_id)
+     protein_b INTEGER NOT NULL
   );
 
 DROP TABLE IF EXISTS multiplesequencealignment CASCADE;
 CREATE TABLE multiplesequencealignment
   (
      msa_id    SERIAL NOT NULL,
-     msa       TEXT NOT NULL,
+     msa       TEXT,
+     msa_zlib  BYTEA,
      cog       INTEGER,
      CONSTRAINT msa_idpk PRIMARY KEY(msa_id),
+     CONSTRAINT msa_stored CHECK ((msa IS NULL) <> (msa_zlib IS NULL)),
      CONSTRAINT cog_fk FOREIGN KEY(cog) REFERENCES cog(cog_id)
   );
@@ -0,0 +1,51 @@
+-- The tables of create_tables.sql for the embedded SQLite database. An
+-- INTEGER PRIMARY KEY is the row ID, which is given out like a SERIAL.
+-- The indexes are added by create_constraints_sqlite.sql once the data
+-- is loaded.
+DROP TABLE IF EXISTS organism;
+CREATE TABLE organism
+  (
+     organism_id INTEGER PRIMARY KEY,
+     name        TEXT NOT NULL
+  );
+
+DROP TABLE IF EXISTS cog;
+CREATE TABLE cog
+  (
+     cog_id INTEGER PRIMARY KEY
+  );
+
+DROP TABLE IF EXISTS protein;
+CREATE TABLE protein
+  (
+     protein_id INTEGER PRIMARY KEY,
+     name       TEXT NOT NULL,
+     sequence   TEXT NOT NULL,
+     organism   INTEGER NOT NULL REFERENCES organism(organism_id),
+     cog        INTEGER REFERENCES cog(cog_id)
+  );
+
+DROP TABLE IF EXISTS temporaryhit;
+CREATE TABLE temporaryhit
+  (
+      protein_a INTEGER NOT NULL,
+      protein_b INTEGER NOT NULL
+  );
+
+DROP TABLE IF EXISTS directionalhit;
+CREATE TABLE directionalhit
+  (
+     hit_id    INTEGER PRIMARY KEY,
+     protein_a INTEGER NOT NULL REFERENCES protein(protein_id),
+     protein_b INTEGER NOT NULL REFERENCES protein(protein_id)
+  );
+
+DROP TABLE IF EXISTS multiplesequencealignment;
+CREATE TABLE multiplesequencealignment
+  (
+     msa_id    INTEGER PRIMARY KEY,
+     msa       TEXT,
+     msa_zlib  BLOB,
+     cog       INTEGER REFERENCES cog(cog_id),
+     CONSTRAINT msa_stored CHECK ((msa IS NULL) <> (msa_zlib IS NULL))
+  );
@@ -0,0 +1,201 @@
+""" An embedded SQLite database which can be used by create_cogs.py in
+place of the PostgreSQL server. The connection and cursor offer the
+part of the psycopg2 interface which create_cogs.py uses, including
+COPY from a file-like object, and translate the few parts of the
+queries which SQLite does not understand: '%s' placeholders and
+'= ANY(%s)' with a list. The PostgreSQL function split_part is added
+to SQLite, as the index on the accessions of the proteins uses it.
+A database file is opened in WAL mode and the
+database is tuned for bulk inserts; ':memory:' keeps the whole
+database in memory.
+"""
+import json
+import re
+import sqlite3
+
+_PARAMETER = re.compile(r"= ANY\(%s\)|%s")
+_COPY_ESCAPE = re.compile(r"\\(.)")
+_COPY_ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t",
+                 "v": "\v"}
+_COPY_BATCH_SIZE = 10000
+_PRAGMAS = ("PRAGMA synchronous = NORMAL", "PRAGMA temp_store = MEMORY",
+            "PRAGMA cache_size = -262144", "PRAGMA foreign_keys = OFF")
+
+
+def statements(query):
+    """ Splits a query into its statements, as SQLite only executes one
+    statement at a time.
+
+    Parameters:
+        query (string): One or more SQL statements separated by ';'.
+    Returns:
+        1. Generator: yields the statements.
+    """
+    statement = ""
+    for part in query.split(";"):
+        statement += part + ";"
+        if sqlite3.complete_statement(statement):
+            if any(line.strip() and not line.strip().startswith("--")
+                   for line in statement[:-1].splitlines()):
+                yield statement
+            statement = ""
+
+
+def split_part(text, delimiter, field):
+    """ Splits a text on a delimiter and gives one of the parts, like
+    split_part of PostgreSQL.
+
+    Parameters:
+        text (string): The text to split.
+        delimiter (string): The delimiter.
+        field (int): The position of the part, starting at 1.
+    Returns:
+        1. String: The part, or an empty string when there are fewer
+        parts. None when the text is None.
+    """
+    if text is None:
+        return None
+    parts = text.split(delimiter)
+    return parts[field - 1] if 0 < field <= len(parts) else ""
+
+
+def copy_value(value, null):
+    """ Reads a value in the text format of COPY.
+
+    Parameters:
+        value (string): The escaped value.
+        null (string): The text which stands for NULL.
+    Returns:
+        1. String: The value, or None for NULL.
+    """
+    if value == null:
+        return None
+    if "\\" not in value:
+        return value
+    return _COPY_ESCAPE.sub(
+        lambda match: _COPY_ESCAPES.get(match.group(1), match.group(1)),
+        value)
+
+
+class EmbeddedCursor(object):
+    """ A cursor of an 'EmbeddedConnection', which wraps a cursor of
+    the sqlite3 module.
+    """
+
+    def __init__(self, connection):
+        """ Creates the cursor.
+
+        Parameters:
+            connection (EmbeddedConnection): The connection of the
+                cursor.
+        """
+        self.connection = connection
+        self._cursor = connection.sqlite.cursor()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, query, vars=None):
+        if vars is None:
+            for statement in statements(query):
+                self._cursor.execute(statement)
+            return
+        values = iter(vars)
+        parameters = []
+
+        def placeholder(match):
+            value = next(values)
+            if match.group(0) == "%s":
+                parameters.append(value)
+                return "?"
+            parameters.append(json.dumps(list(value)))
+            return "IN (SELECT value FROM json_each(?))"
+        self._cursor.execute(_PARAMETER.sub(placeholder, query), parameters)
+
+    def executemany(self, query, vars_list):
+        self._cursor.executemany(query.replace("%s", "?"), vars_list)
+
+    def copy_from(self, file, table, sep="\t", null="\\N", size=8192,
+                  columns=None):
+        """ Inserts the rows of a file in the text format of COPY into
+        a table, in batches of _COPY_BATCH_SIZE rows. The file is read
+        one line at a time, so it is never fully in memory. The
+        arguments are those of the psycopg2 cursor.
+        """
+        if columns is None:
+            self._cursor.execute("SELECT * FROM {} LIMIT 0".format(table))
+            columns = [column[0] for column in self._cursor.description]
+        query = "INSERT INTO {} ({}) VALUES ({})".format(
+            table, ", ".join(columns), ", ".join(["?"] * len(columns)))
+        rows = []
+        for line in iter(file.readline, ""):
+            rows.append([copy_value(value, null)
+                         for value in line.rstrip("\n").split(sep)])
+            if len(rows) >= _COPY_BATCH_SIZE:
+                self._cursor.executemany(query, rows)
+                rows = []
+        self._cursor.executemany(query, rows)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+
+class EmbeddedConnection(object):
+    """ A connection with an embedded SQLite database, which acts like
+    a psycopg2 connection.
+    """
+
+    def __init__(self, file_name, cursor_factory=EmbeddedCursor):
+        """ Opens the database, which is created when it does not exist.
+
+        Parameters:
+            file_name (string): The name of the database file, or
+                ':memory:' for a database in memory.
+            cursor_factory (class): The class of the cursors, a
+                subclass of EmbeddedCursor.
+        """
+        self.file_name = file_name
+        self.cursor_factory = cursor_factory
+        self.sqlite = sqlite3.connect(file_name)
+        self.sqlite.create_function("split_part", 3, split_part,
+                                    deterministic=True)
+        if file_name != ":memory:":
+            self.sqlite.execute("PRAGMA journal_mode = WAL")
+        for pragma in _PRAGMAS:
+            self.sqlite.execute(pragma)
+
+    def cursor(self, name=None, withhold=False):
+        """ Creates a cursor. A cursor of SQLite already reads its rows
+        one at a time and stays valid over commits, so a named cursor
+        is the same as any other cursor.
+
+        Parameters:
+            name (string): Ignored.
+            withhold (boolean): Ignored.
+        Returns:
+            1. EmbeddedCursor: The cursor.
+        """
+        return self.cursor_factory(self)
+
+    def commit(self):
+        self.sqlite.commit()
+
+    def rollback(self):
+        self.sqlite.rollback()
+
+    def close(self):
+        self.sqlite.close()
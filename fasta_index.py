@@ -0,0 +1,141 @@
+""" Reads fasta files through an index of the byte offsets of every
+record, in the style of the .fai index of samtools. The file is memory
+mapped and the records are found with a single regular expression over
+the whole file, so there is no Python work per line. Sequences are only
+read from the file when they are asked for.
+"""
+from array import array
+
+import mmap
+import re
+
+_HEADER = re.compile(rb"\n>([^\n]*)")
+_WHITESPACE = b" \t\r\n"
+
+
+class FastaIndex(object):
+    """ An index of a fasta file. Records are kept in the order of the
+    file and can be looked up by their accession, the first word of the
+    name. Records without a name are skipped. The index can be used as
+    a context manager which closes the file afterwards.
+    """
+
+    def __init__(self, file_name):
+        """ Opens and indexes a fasta file.
+
+        Parameters:
+            file_name (string): The name of the fasta file.
+        """
+        self.file_name = file_name
+        self._file = open(file_name, "rb")
+        try:
+            self._data = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file cannot be mapped.
+            self._data = b""
+        data = self._data
+        spans = [match.span(1) for match in _HEADER.finditer(data)]
+        if data[:1] == b">":
+            first_end = data.find(b"\n")
+            spans.insert(0, (1, len(data) if first_end < 0 else first_end))
+        names = b"\n".join([data[start:end] for start, end in spans])
+        names = [name.strip() for name in names.decode().split("\n")]
+        starts = [end + 1 for _, end in spans]
+        # The sequence of a record ends where the next header starts.
+        ends = [start - 2 for start, _ in spans[1:]] + [len(data)]
+        if not all(names):
+            keep = [index for index, name in enumerate(names) if name]
+            names = [names[index] for index in keep]
+            starts = [starts[index] for index in keep]
+            ends = [ends[index] for index in keep]
+        self._names = names
+        self._starts = array("q", starts)
+        self._ends = array("q", ends)
+        self._accessions = None
+
+    def __len__(self):
+        """ Gives the amount of records. """
+        return len(self._names)
+
+    def __contains__(self, accession):
+        """ Tells whether a record has the given accession. """
+        return accession in self._accession_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def names(self):
+        """ Gives the full names (only the '>' is stripped off) of the
+        records in the order of the file.
+
+        Parameters:
+            -
+        Returns:
+            1. List of strings: The names.
+        """
+        return self._names
+
+    def sequence(self, accession):
+        """ Reads the sequence of a record from the file.
+
+        Parameters:
+            accession (string): The accession of the record. When
+                several records share it, the last one is used.
+        Returns:
+            1. String: The sequence.
+        """
+        return self._sequence(self._accession_index()[accession])
+
+    def _accession_index(self):
+        """ Gives the position of every accession, which is only
+        determined the first time it is needed.
+
+        Parameters:
+            -
+        Returns:
+            1. Dictionary: A dictionary with accessions as keys and the
+            position of their record as values.
+        """
+        if self._accessions is None:
+            self._accessions = {name.split()[0]: index
+                                for index, name in enumerate(self._names)}
+        return self._accessions
+
+    def _sequence(self, index):
+        """ Reads the sequence of the record at a position in the file.
+
+        Parameters:
+            index (int): The position of the record.
+        Returns:
+            1. String: The sequence.
+        """
+        return self._data[self._starts[index]:self._ends[index]].translate(
+            None, _WHITESPACE).decode()
+
+    def records(self):
+        """ Reads the records one at a time in the order of the file.
+
+        Parameters:
+            -
+        Returns:
+            1. Generator: yields tuples with the full name (only the
+            '>' is stripped off) (0) and the sequence (1).
+        """
+        for index, name in enumerate(self._names):
+            yield name, self._sequence(index)
+
+    def close(self):
+        """ Closes the file.
+
+        Parameters:
+            -
+        Returns:
+            -
+        """
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
@@ -0,0 +1,485 @@
+""" Checks that the cogs found by create_cogs.py are still the cogs of
+the original algorithm, which kept the twogs in a list and looked
+through the whole list for every protein. The original algorithm is
+repeated here in 'baseline_cogs' and compared with 'find_cogs' on
+random graphs of twogs in the stub database of benchmark.py, with one
+and with several '--cog-jobs'. The alignments are compared with those
+of the original parser in 'baseline_msa' and stored in the database
+as text and compressed. The records read by 'FastaIndex' are compared
+with those of the original line by line loop in 'baseline_records'.
+The whole pipeline is run with the stub search and aligner on an
+embedded database, in memory and with '--incremental' in a file, which
+must give the same cogs as a run on all organisms at once.
+Run with 'python -m pytest'.
+"""
+from collections import Counter, OrderedDict
+
+import random
+import sqlite3
+import sys
+
+import pytest
+
+import benchmark
+import create_cogs
+from embedded_database import EmbeddedConnection
+from fasta_index import FastaIndex
+
+
+def random_database(seed, organisms=5, proteins=40, density=0.4):
+    """ Creates a stub database with random twogs. Protein i of every
+    organism has a twog with a protein near position i of every other
+    organism with a chance of density, and random proteins of different
+    organisms have twogs as well.
+
+    Parameters:
+        seed (int): The seed of the randomness.
+        organisms (int): The amount of organisms.
+        proteins (int): The amount of proteins per organism.
+        density (float): The chance of a twog within a family.
+    Returns:
+        1. StubDatabase: The database.
+    """
+    rng = random.Random(seed)
+    database = benchmark.StubDatabase()
+    database.organisms = benchmark.organism_names(organisms)
+    members = []
+    for organism in range(1, organisms + 1):
+        first = len(database.proteins) + 1
+        members.append(list(range(first, first + proteins)))
+        for protein in members[-1]:
+            database.proteins[protein] = [
+                "p{}".format(protein), "M", organism, None]
+    twogs = set()
+    for index, proteins1 in enumerate(members):
+        for proteins2 in members[index + 1:]:
+            partners = proteins2[:]
+            for _ in range(proteins // 4):
+                i, j = rng.randrange(proteins), rng.randrange(proteins)
+                partners[i], partners[j] = partners[j], partners[i]
+            twogs.update((protein1, protein2) for protein1, protein2
+                         in zip(proteins1, partners)
+                         if rng.random() < density)
+    for _ in range(organisms * proteins):
+        protein1, protein2 = sorted(rng.sample(list(database.proteins), 2))
+        if database.proteins[protein1][2] != database.proteins[protein2][2]:
+            twogs.add((protein1, protein2))
+    database.twogs = sorted(twogs)
+    rng.shuffle(database.twogs)
+    return database
+
+
+def remove_twogs(twogs, proteins):
+    """ Removes the twogs which contain one of the proteins, like the
+    original algorithm.
+
+    Parameters:
+        twogs (list): Tuples containing bidirectional hits.
+        proteins (iterable of ints): The protein ID's.
+    Returns:
+        -
+    """
+    proteins = set(proteins)
+    twogs[:] = [twog for twog in twogs
+                if twog[0] not in proteins and twog[1] not in proteins]
+
+
+def baseline_cogs(database):
+    """ Finds the cogs with the original algorithm of create_cogs.py.
+
+    Parameters:
+        database (StubDatabase): The database with the twogs.
+    Returns:
+        1. Dictionary: The protein ID's which are in a cog as keys and
+        their cog as values.
+    """
+    organism = {protein: row[2] for protein, row in database.proteins.items()}
+    cogs = dict()
+    twogs = []
+    for organism1 in range(1, len(database.organisms) + 1):
+        for organism2 in range(1, organism1):
+            twogs.extend(twog for twog in database.twogs if {
+                organism[twog[0]], organism[twog[1]]} == {organism1,
+                                                          organism2})
+        if organism1 < 3:
+            continue
+        cog_map = dict()
+        for protein, cog in sorted(cogs.items(),
+                                   key=lambda item: (item[1], item[0])):
+            cog_map.setdefault(cog, []).append(protein)
+        skip_proteins = []
+        for cog, cog_proteins in cog_map.items():
+            protein_counter = Counter()
+            delete_twogs = []
+            for twog in twogs:
+                for cog_protein in cog_proteins:
+                    if cog_protein in twog:
+                        protein_counter[twog[int(twog[1] != cog_protein)]] += 1
+                        delete_twogs.append(cog_protein)
+            if protein_counter:
+                common_protein = protein_counter.most_common(1)[0][0]
+                cogs[common_protein] = cog
+                remove_twogs(twogs, delete_twogs + [common_protein])
+                skip_proteins.append(common_protein)
+        cog_id = max(cogs.values(), default=0) + 1
+        for protein in set(protein for twog in database.twogs
+                           for protein in twog
+                           if organism[protein] == organism1 and
+                           protein not in skip_proteins):
+            found_twogs = [twog[int(twog[1] != protein)] for twog in twogs
+                           if protein in twog]
+            hidden_twogs = set()
+            for index, protein1 in enumerate(found_twogs):
+                for protein2 in found_twogs[index + 1:]:
+                    if (protein1, protein2) in twogs or \
+                            (protein2, protein1) in twogs:
+                        hidden_twogs.update([protein1, protein2, protein])
+            if hidden_twogs:
+                cogs.update((member, cog_id) for member in hidden_twogs)
+                remove_twogs(twogs, hidden_twogs)
+                cog_id += 1
+    return cogs
+
+
+def database_cogs(database):
+    """ Retrieves the cogs of the proteins in a stub database.
+
+    Parameters:
+        database (StubDatabase): The database.
+    Returns:
+        1. Dictionary: The protein ID's which are in a cog as keys and
+        their cog as values.
+    """
+    return {protein: row[3] for protein, row in database.proteins.items()
+            if row[3] is not None}
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_find_cogs_matches_baseline(seed, monkeypatch):
+    expected = baseline_cogs(random_database(seed))
+    assert expected
+    for jobs in (1, 3):
+        monkeypatch.setattr(sys, "argv", [
+            "create_cogs.py", "--cog-jobs", str(jobs)])
+        database = random_database(seed)
+        create_cogs.find_cogs(database, database.cursor(),
+                              database.organisms)
+        assert database_cogs(database) == expected, jobs
+
+
+_CLUSTALW_OUTPUT = """CLUSTAL 2.1 multiple sequence alignment
+
+
+orgA_p1         MKV-LAAGIVALLLAAGCSS-----
+orgB_p7         MKVALAAG-VALLLAAGCSSKQ---
+orgC_p3         MRV-LAAGIVALLVAAGCSSKQEPT
+                *:* **** **** *******     
+
+orgA_p1         AEKTW-
+orgB_p7         GDRSYL
+orgC_p3         ---SFL
+                      
+"""
+_MAFFT_OUTPUT = """CLUSTAL format alignment by MAFFT FFT-NS-2 (v7.490)
+
+
+sp|P69905|HBA_HUMAN      mvlspadktnvkaawgkvgahageygaealermflsfpttktyfphf-dls
+sp|P01942|HBA_MOUSE      mvlsgedksnikaawgkigghgaeygaealermfasfpttktyfphf-dvs
+sp|P68871|HBB_HUMAN      mvhltpeeksavtalwgkv--nvdevggealgrllvvypwtqrffesfgdl
+                         **   . ** : :* ***:        ***** : : :* *  ::  * * 
+
+sp|P69905|HBA_HUMAN      hgsaqvkghgkkvadaltnavahv
+sp|P01942|HBA_MOUSE      hgsaqvkghgkkvadalasaaghl
+sp|P68871|HBB_HUMAN      tpdavmgnpkvkahgkkvlgafsd
+                            *  *.  *  :*  .  .   
+"""
+
+
+def baseline_msa(text):
+    """ Parses an alignment with the original parser of create_cogs.py,
+    which read the alignment file line by line.
+
+    Parameters:
+        text (string): The alignment in the ClustalW format.
+    Returns:
+        1. String: the complete multiple sequence alignment
+    """
+    msa = OrderedDict()
+    start_index = None
+    for line in text.splitlines(True)[1:]:
+        if len(line) > 1:
+            lines = line.split()
+            if len(lines) == 2:
+                if lines[0] not in msa:
+                    msa[lines[0]] = ""
+                msa[lines[0]] += lines[1]
+                start_index = line.find(lines[1])
+            else:
+                if "consensus" not in msa:
+                    msa["consensus"] = ""
+                msa["consensus"] += line[start_index:-1]
+    msa_text = ""
+    for accession, sequence in msa.items():
+        msa_text += '{}{}{}\n'.format(
+            accession, " " * (start_index - len(accession)), sequence)
+    return msa_text
+
+
+@pytest.mark.parametrize("text", [
+    _CLUSTALW_OUTPUT, _MAFFT_OUTPUT,
+    "".join(benchmark.clustal_lines(20, random.Random(1)))])
+def test_parse_alignment_matches_baseline(text, tmp_path):
+    (tmp_path / "msa.aln").write_text(text)
+    assert create_cogs.get_msa(str(tmp_path / "msa.aln")) == \
+        baseline_msa(text)
+    assert create_cogs.parse_alignment(text.splitlines(True)) == \
+        baseline_msa(text)
+
+
+def test_parse_alignment_consensus():
+    # A consensus line with two words was read as a sequence called
+    # '***' by the original parser.
+    text = ("CLUSTAL 2.1 multiple sequence alignment\n\n\n"
+            "orgA_p1         MKVLA-G\n"
+            "orgB_p7         MKVLSAG\n"
+            "                ****  *\n")
+    assert create_cogs.parse_alignment(text.splitlines(True)) == (
+        "orgA_p1         MKVLA-G\n"
+        "orgB_p7         MKVLSAG\n"
+        "consensus       ****  *\n")
+    # The names are padded further when 'consensus' does not fit.
+    text = "CLUSTAL\n\na  MK-\nb  MKV\n   ** \n"
+    assert create_cogs.parse_alignment(text.splitlines(True)) == (
+        "a         MK-\nb         MKV\nconsensus ** \n")
+
+
+def test_compressed_alignments():
+    msa = create_cogs.parse_alignment(_MAFFT_OUTPUT.splitlines(True))
+    assert create_cogs.decode_msa(
+        None, create_cogs.compress_msa(msa)) == msa
+    assert create_cogs.decode_msa(
+        None, memoryview(create_cogs.compress_msa(msa))) == msa
+    connection = EmbeddedConnection(":memory:")
+    cursor = connection.cursor()
+    with open(create_cogs.sql_file(connection, "create_tables.sql")) as sql:
+        cursor.execute(sql.read())
+    create_cogs.insert_alignments(cursor, [(1, msa)])
+    create_cogs.insert_alignments(cursor, [(2, msa)], compress=True)
+    cursor.execute("""SELECT cog, msa IS NULL, msa_zlib IS NULL
+                      FROM multiplesequencealignment ORDER BY cog""")
+    assert cursor.fetchall() == [(1, 0, 1), (2, 1, 0)]
+    cursor.execute("SELECT msa, msa_zlib FROM multiplesequencealignment")
+    assert [create_cogs.decode_msa(*row) for row in cursor] == [msa, msa]
+    # Every alignment is stored in exactly one of the columns.
+    for row in ((3, None, None), (3, msa, create_cogs.compress_msa(msa))):
+        with pytest.raises(sqlite3.IntegrityError):
+            cursor.execute("INSERT INTO multiplesequencealignment " +
+                           "(cog, msa, msa_zlib) VALUES (%s, %s, %s)", row)
+    connection.close()
+
+
+def baseline_records(file_name):
+    """ Reads the records of a fasta file like the original loop of
+    fill_protein_table, which skipped records without a name.
+
+    Parameters:
+        file_name (string): The name of the fasta file.
+    Returns:
+        1. List: Tuples with the full name (0) and the sequence (1).
+    """
+    records = []
+    last_prot = ""
+    last_seq = ""
+    with open(file_name) as infile:
+        for line in infile:
+            if line[0] == ">":
+                if last_prot:
+                    records.append((last_prot, last_seq))
+                last_prot = line[1:].strip()
+                last_seq = ""
+            else:
+                last_seq += line.strip()
+    if last_prot:
+        records.append((last_prot, last_seq))
+    return records
+
+
+@pytest.mark.parametrize("data", [
+    b">a first protein\nMKVL\nAAG\n>b\nGG\n",
+    b">a first protein\r\nMKVL\r\nAAG\r\n>b\r\nGG\r\n",
+    b"",
+    b"no header\nMKVL\n>a\nAAG\n>b\nGG",
+    b">a\nMKVL\n>\nLOST\n> \nALSO LOST\n>b\nGG\n",
+    b">a first\nMKVL\n>a second\nAAG\n>b\nGG\n",
+    b"\n>a\n\nMKVL\n\n>b\nGG\n\n",
+], ids=["lf", "crlf", "empty", "no_header", "nameless", "duplicate",
+        "blank_lines"])
+def test_fasta_index_matches_baseline(data, tmp_path):
+    (tmp_path / "test.fa").write_bytes(data)
+    expected = baseline_records(str(tmp_path / "test.fa"))
+    with FastaIndex(str(tmp_path / "test.fa")) as index:
+        assert list(index.records()) == expected
+        assert index.names() == [name for name, _ in expected]
+        assert len(index) == len(expected)
+        # The last record of an accession is used, like the original
+        # mapping of accessions to protein ID's.
+        for accession, sequence in {
+                name.split()[0]: sequence for name, sequence in expected
+        }.items():
+            assert accession in index
+            assert index.sequence(accession) == sequence
+        assert "LOST" not in index
+
+
+def write_project(directory, organisms, seed=1):
+    """ Writes the proteomes and the canned hits of the stub search of
+    organisms to the Project_files directory, along with an
+    Organismen.txt with all organisms.
+
+    Parameters:
+        directory (pathlib.Path): The directory of the project.
+        organisms (list of strings): The names of the organisms.
+        seed (int): The seed of the generated data.
+    Returns:
+        -
+    """
+    project_files = directory / "Project_files"
+    project_files.mkdir()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(project_files)
+        benchmark.generate_data(organisms, 60, 0.7, 3, random.Random(seed))
+    for org1, org2 in create_cogs.organism_pairs(organisms):
+        hits = project_files / "{}__{}".format(org1, org2)
+        (project_files / (hits.name + ".hits")).write_text(
+            hits.read_text().replace(";", " "))
+    write_organisms(directory, organisms)
+
+
+def write_organisms(directory, organisms):
+    """ Writes the organisms of a run to Organismen.txt.
+
+    Parameters:
+        directory (pathlib.Path): The directory of the project.
+        organisms (list of strings): The names of the organisms.
+    Returns:
+        -
+    """
+    (directory / "Project_files" / "Organismen.txt").write_text(
+        "\n".join(organisms))
+
+
+def run_create_cogs(monkeypatch, directory, *arguments):
+    """ Runs create_cogs.py with the stub search and aligner.
+
+    Parameters:
+        monkeypatch (pytest.MonkeyPatch): Restores the arguments and
+            the working directory afterwards.
+        directory (pathlib.Path): The directory of the project.
+        *arguments: Other command line arguments.
+    Returns:
+        -
+    """
+    monkeypatch.chdir(directory)
+    monkeypatch.setattr(create_cogs, "_METRICS", create_cogs.Metrics())
+    monkeypatch.setattr(sys, "argv", [
+        "create_cogs.py", "--search", "stub", "--aligner", "stub"] +
+        list(arguments))
+    create_cogs.main()
+
+
+def record_alignments(monkeypatch):
+    """ Remembers which cogs are aligned from now on.
+
+    Parameters:
+        monkeypatch (pytest.MonkeyPatch): Restores 'align_cogs'
+            afterwards.
+    Returns:
+        1. List of ints: The cogs, in the order they are aligned.
+    """
+    aligned = []
+    align_cogs = create_cogs.align_cogs
+
+    def record(*arguments):
+        for cog, msa in align_cogs(*arguments):
+            aligned.append(cog)
+            yield cog, msa
+    monkeypatch.setattr(create_cogs, "align_cogs", record)
+    return aligned
+
+
+def sqlite_results(directory):
+    """ Retrieves the results of a run with '--storage sqlite'.
+
+    Parameters:
+        directory (pathlib.Path): The directory of the project.
+    Returns:
+        1. Dictionary: The protein ID's which are in a cog as keys and
+        their cog as values.
+        2. Dictionary: The cogs as keys and their amount of proteins
+        as values.
+        3. List of ints: The cogs without an alignment.
+    """
+    connection = EmbeddedConnection(str(
+        directory / "Project_files" / create_cogs._SQLITE_FILE))
+    cursor = connection.cursor()
+    cursor.execute("SELECT protein_id, cog FROM protein WHERE cog IS NOT NULL")
+    cogs = dict(cursor.fetchall())
+    results = (cogs, create_cogs.get_cog_sizes(cursor),
+               create_cogs.get_unaligned_cogs(cursor))
+    connection.close()
+    return results
+
+
+def test_pipeline_with_stubs(tmp_path, monkeypatch):
+    names = benchmark.organism_names(5)
+    write_project(tmp_path, names)
+    # The database in memory is gone once it is closed, so it is kept
+    # open to look at the results.
+    connections = []
+    connect_database = create_cogs.connect_database
+
+    def connect(storage="postgres"):
+        connections.append(connect_database(storage))
+        return connections[-1]
+    monkeypatch.setattr(create_cogs, "connect_database", connect)
+    monkeypatch.setattr(EmbeddedConnection, "close", lambda self: None)
+    run_create_cogs(monkeypatch, tmp_path, "--storage", "memory")
+    cursor = connections[0].cursor()
+    cursor.execute("SELECT protein_id, cog FROM protein WHERE cog IS NOT NULL")
+    cogs = dict(cursor.fetchall())
+    assert cogs
+    assert create_cogs.get_unaligned_cogs(cursor) == []
+
+    monkeypatch.setattr(sys, "argv", ["create_cogs.py"])
+    for org1, org2 in create_cogs.organism_pairs(names):
+        create_cogs.write_direct_hits(org1, org2)
+    database = benchmark.StubDatabase()
+    create_cogs.fill_database(database, database.cursor(), names)
+    create_cogs.find_cogs(database, database.cursor(), names)
+    assert cogs == database_cogs(database)
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_incremental_matches_full_run(jobs, tmp_path, monkeypatch):
+    names = benchmark.organism_names(6)
+    for directory in ("incremental", "full"):
+        (tmp_path / directory).mkdir()
+        write_project(tmp_path / directory, names, seed=3)
+    write_organisms(tmp_path / "incremental", names[:-1])
+    run_create_cogs(monkeypatch, tmp_path / "incremental", "--storage",
+                    "sqlite", "--cog-jobs", str(jobs))
+    _, sizes, _ = sqlite_results(tmp_path / "incremental")
+    aligned = record_alignments(monkeypatch)
+    write_organisms(tmp_path / "incremental", names)
+    run_create_cogs(monkeypatch, tmp_path / "incremental", "--storage",
+                    "sqlite", "--cog-jobs", str(jobs), "--incremental")
+    cogs, new_sizes, unaligned = sqlite_results(tmp_path / "incremental")
+    assert unaligned == []
+    # Some cogs do not get proteins of the new organism, those must not
+    # be aligned again.
+    assert len(aligned) < len(new_sizes)
+    assert sorted(aligned) == sorted(cog for cog, size in new_sizes.items()
+                                     if sizes.get(cog) != size)
+    run_create_cogs(monkeypatch, tmp_path / "full", "--storage", "sqlite",
+                    "--cog-jobs", str(jobs))
+    assert cogs == sqlite_results(tmp_path / "full")[0]